@@ -0,0 +1,820 @@
+# Copyright (C) 2010 INRIA - EDF R&D
+# Authors: Damien Garaud
+#
+# This file is part of the PuppetMaster project. It provides facilities to
+# deal with computations over a Linux network.
+#
+# This script is free; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+
+"""\package agent
+
+Provides a lightweight agent which runs on a host and launches the commands
+sent by PuppetMaster.
+
+The agent is started over a single SSH session (see 'Agent.Start'): the
+source of this module is sent to the standard input of a remote Python
+interpreter and the function 'serve' is called. Then the agent and the
+controller exchange messages, one JSON object per line:
+ <ul>
+  <li>from the controller: "launch", "kill" and "exit" requests;</li>
+  <li>from the agent: "ready", "start", "output" and "exit" notifications
+  with the dates of the host, and periodic "load" samples.</li>
+ </ul>
+
+A batch of commands can also be run over a single session without agent
+(see 'Batch'): a shell script launches them and sends the same notifications,
+one line per notification.
+
+This module is run by the remote hosts as it is: it does not depend on the
+other PuppetMaster modules and it is compatible with Python 3.
+
+Class list:
+ <ul>
+  <li>Agent</li>
+  <li>AgentProcess</li>
+  <li>AgentServer</li>
+  <li>Batch</li>
+ </ul>
+
+\author Damien Garaud
+"""
+
+import os
+import sys
+import time
+import json
+import base64
+import select
+import signal
+import threading
+import subprocess
+
+
+## The shell script which runs a batch of commands (see 'Batch'). Its
+## arguments are 1 if the outputs are kept (0 otherwise), the maximum number
+## of bytes sent for each output (0 for no limit) and the commands encoded in
+## base64. It writes the lines "start i pid date",
+## "output i stream data" (in base64) and "exit i status date" to its
+## standard output, and reads the lines "i signal" on its standard input.
+__batch__ = """
+d=`mktemp -d /tmp/puppet-batch-XXXXXX` || exit 1
+mkfifo $d/event || exit 1
+exec 3<&0 4<>$d/event
+keep=$1
+max=$2
+shift 2
+t=cat
+[ "$max" -gt 0 ] && t="tail -c $max"
+n=0
+for c in "$@"; do
+    n=$((n + 1))
+    (
+        o=/dev/null
+        e=/dev/null
+        [ "$keep" = 1 ] && o=$d/$n.stdout && e=$d/$n.stderr
+        b=`date +%s.%N`
+        setsid sh -c "`echo $c | base64 -d`" >$o 2>$e \\
+            </dev/null 3<&- 4<&- &
+        echo "start $n $! $b" >&4
+        wait $!
+        s=$?
+        echo "exit $n $s `date +%s.%N`" >&4
+    ) 2>/dev/null &
+done
+(
+    while read i k; do
+        p=`cat $d/$i.pid 2>/dev/null` && kill -$k -$p
+    done
+) <&3 >/dev/null 2>&1 &
+r=$!
+while [ $n -gt 0 ] && read e i a b <&4; do
+    if [ $e = start ]; then
+        echo $a >$d/$i.pid
+    else
+        for f in stdout stderr; do
+            [ -s $d/$i.$f ] \\
+                && echo "output $i $f `$t <$d/$i.$f | base64 -w 0`"
+        done
+        n=$((n - 1))
+    fi
+    echo "$e $i $a $b"
+done
+kill $r 2>/dev/null
+rm -rf $d
+"""
+
+
+###########################
+# MISCELLANEOUS FUNCTIONS #
+###########################
+
+
+def shell_quote(text):
+    """Quotes a string for the shell.
+    \param text The string.
+    @return The string between single quotes.
+    """
+    return "'" + text.replace("'", "'\\''") + "'"
+
+
+def read_sample():
+    """Reads the load averages and the used memory of the host.
+    @return A tuple (load averages, used memory in kB), where the values are
+    "off" if they cannot be read.
+    """
+    try:
+        loadavg_file = open("/proc/loadavg", 'r')
+        uptime = [float(x) for x in loadavg_file.read().split()[:3]]
+        loadavg_file.close()
+    except (IOError, ValueError):
+        uptime = "off"
+    try:
+        meminfo_file = open("/proc/meminfo", 'r')
+        meminfo = {}
+        for line in meminfo_file.readlines():
+            field = line.split()
+            if len(field) > 1:
+                meminfo[field[0].rstrip(":")] = int(field[1])
+        meminfo_file.close()
+        if "MemAvailable" in meminfo:
+            used_memory = meminfo["MemTotal"] - meminfo["MemAvailable"]
+        else:
+            used_memory = meminfo["MemTotal"] - meminfo["MemFree"] \
+                - meminfo.get("Buffers", 0) - meminfo.get("Cached", 0)
+    except (IOError, ValueError, KeyError):
+        used_memory = "off"
+    return uptime, used_memory
+
+
+def serve(interval = 10.):
+    """Runs the agent on the standard input and output.
+    \param interval The period of time between two load samples (in
+    seconds).
+    """
+    AgentServer(sys.stdin, sys.stdout, interval).Run()
+
+
+################
+# AGENT SERVER #
+################
+
+
+class AgentServer:
+    """The agent which runs on a host.
+    It launches the requested commands, streams their outputs and notifies
+    their ends.
+    """
+
+
+    def __init__(self, input_, output, interval = 10.):
+        """Initializes the agent.
+        \param input_ The file object of the requests.
+        \param output The file object of the notifications.
+        \param interval The period of time between two load samples (in
+        seconds).
+        """
+        ## The file object of the requests.
+        self.input = input_
+
+        ## The file object of the notifications.
+        self.output = output
+
+        ## The period of time between two load samples.
+        self.interval = interval
+
+        ## The running processes indexed by their identifiers.
+        self.process = {}
+
+        ## A lock on the notifications.
+        self.lock = threading.Lock()
+
+        ## Set when the agent stops.
+        self.stop = threading.Event()
+
+
+    def Send(self, message):
+        """Sends a notification to the controller.
+        \param message A dictionary.
+        """
+        self.lock.acquire()
+        try:
+            self.output.write(json.dumps(message) + "\n")
+            self.output.flush()
+        finally:
+            self.lock.release()
+
+
+    def Run(self):
+        """Processes the requests until the controller leaves.
+        The running processes are killed at the end.
+        """
+        sampler = threading.Thread(target = self.Sample)
+        sampler.daemon = True
+        sampler.start()
+        self.Send({"ev": "ready", "pid": os.getpid(), "time": time.time()})
+        while True:
+            line = self.input.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message["op"] == "launch":
+                self.Launch(message)
+            elif message["op"] == "kill":
+                self.Kill(message["id"], message.get("signal",
+                                                     signal.SIGTERM))
+            elif message["op"] == "exit":
+                break
+        self.stop.set()
+        for identifier in list(self.process.keys()):
+            self.Kill(identifier, signal.SIGKILL)
+
+
+    def Launch(self, message):
+        """Launches a command.
+        \param message The "launch" request.
+        """
+        identifier = message["id"]
+        devnull = open(os.devnull, 'r')
+        try:
+            process = subprocess.Popen(message["command"], shell = True,
+                                       stdin = devnull,
+                                       stdout = subprocess.PIPE,
+                                       stderr = subprocess.PIPE,
+                                       close_fds = True,
+                                       preexec_fn = os.setsid)
+        except OSError:
+            self.Send({"ev": "exit", "id": identifier, "status": 127,
+                       "time": time.time()})
+            return
+        finally:
+            devnull.close()
+        self.process[identifier] = process
+        self.Send({"ev": "start", "id": identifier, "pid": process.pid,
+                   "time": time.time()})
+        watcher = threading.Thread(target = self.Watch,
+                                   args = (identifier, process,
+                                           message.get("stdout", True)))
+        watcher.daemon = True
+        watcher.start()
+
+
+    def Watch(self, identifier, process, send_stdout):
+        """Streams the outputs of a process and notifies its end.
+        \param identifier The identifier of the process.
+        \param process The 'subprocess.Popen' instance.
+        \param send_stdout Is the standard output sent? (True or False). The
+        standard error is always sent.
+        """
+        stream = {process.stdout.fileno(): "stdout",
+                  process.stderr.fileno(): "stderr"}
+        while len(stream) != 0:
+            for descriptor in select.select(list(stream.keys()), [], [])[0]:
+                data = os.read(descriptor, 65536)
+                if not data:
+                    del stream[descriptor]
+                elif stream[descriptor] == "stderr" or send_stdout:
+                    self.Send({"ev": "output", "id": identifier,
+                               "stream": stream[descriptor],
+                               "data": base64.b64encode(data)
+                               .decode("ascii")})
+        status = process.wait()
+        end_time = time.time()
+        process.stdout.close()
+        process.stderr.close()
+        del self.process[identifier]
+        self.Send({"ev": "exit", "id": identifier, "status": status,
+                   "time": end_time})
+
+
+    def Kill(self, identifier, signal_number):
+        """Sends a signal to a process and to its children.
+        \param identifier The identifier of the process.
+        \param signal_number The signal.
+        """
+        process = self.process.get(identifier)
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, signal_number)
+        except OSError:
+            pass
+
+
+    def Sample(self):
+        """Sends the load averages and the used memory periodically.
+        """
+        while not self.stop.is_set():
+            uptime, used_memory = read_sample()
+            self.Send({"ev": "load", "uptime": uptime,
+                       "used_memory": used_memory, "time": time.time()})
+            self.stop.wait(self.interval)
+
+
+#########
+# AGENT #
+#########
+
+
+class Agent:
+    """The controller side of an agent.
+    It starts the agent on a host and launches commands through it.
+    """
+
+
+    def __init__(self, prefix = "", python = None, interval = 10.,
+                 callback = None):
+        """Initializes the agent.
+        \param prefix The command which gives access to the host, such as
+        "ssh keats". An empty string stands for the local host.
+        \param python The Python interpreter on the host. By default, the
+        current interpreter for the local host and "python" otherwise.
+        \param interval The period of time between two load samples (in
+        seconds).
+        \param callback A function called with the load averages, the used
+        memory and the date of each load sample.
+        """
+        ## The command which gives access to the host.
+        self.prefix = prefix
+
+        if python is None:
+            if prefix == "":
+                python = sys.executable
+            else:
+                python = "python"
+        ## The Python interpreter on the host.
+        self.python = python
+
+        ## The period of time between two load samples.
+        self.interval = interval
+
+        ## The function called with each load sample.
+        self.callback = callback
+
+        ## The 'subprocess.Popen' instance of the agent.
+        self.agent = None
+
+        ## The 'AgentProcess' instances indexed by their identifiers.
+        self.process = {}
+
+        ## The identifier of the next process.
+        self.identifier = 0
+
+        ## A lock on the requests.
+        self.lock = threading.Lock()
+
+        ## Set when the agent is ready.
+        self.ready = threading.Event()
+
+        ## Set when the agent is ready or when it ended.
+        self.started = threading.Event()
+
+        ## The latest load averages.
+        self.uptime = "off"
+
+        ## The latest used memory.
+        self.used_memory = "off"
+
+        ## The date of the latest load sample.
+        self.sample_time = None
+
+
+    def Start(self, timeout = 60.):
+        """Starts the agent.
+        \param timeout The maximum waiting time for the agent (in seconds).
+        @return True if the agent is ready, False otherwise.
+        """
+        filename = os.path.splitext(os.path.abspath(__file__))[0] + ".py"
+        source_file = open(filename, 'r')
+        source = source_file.read()
+        source_file.close()
+        bootstrap = "%s -u -c 'import sys; exec(sys.stdin.read(%i)); " \
+            "serve(%f)'" % (self.python, len(source), self.interval)
+        if self.prefix == "":
+            command = bootstrap
+        else:
+            command = self.prefix + ' "' + bootstrap + '"'
+        devnull = open(os.devnull, 'w')
+        self.agent = subprocess.Popen([command], shell = True,
+                                      stdin = subprocess.PIPE,
+                                      stdout = subprocess.PIPE,
+                                      stderr = devnull, close_fds = True)
+        devnull.close()
+        self.ready.clear()
+        self.started.clear()
+        try:
+            self.Write(source)
+        except IOError:
+            # The agent already ended.
+            pass
+        reader = threading.Thread(target = self.Read)
+        reader.daemon = True
+        reader.start()
+        self.started.wait(timeout)
+        if not self.ready.is_set():
+            self.Stop()
+        return self.ready.is_set()
+
+
+    def IsAlive(self):
+        """Is the agent running?
+        @return True if the agent is ready and running, False otherwise.
+        """
+        return self.ready.is_set() and self.agent is not None \
+            and self.agent.poll() is None
+
+
+    def Stop(self):
+        """Stops the agent.
+        The processes still running are killed.
+        """
+        if self.agent is None:
+            return
+        try:
+            self.Send({"op": "exit"})
+            self.agent.stdin.close()
+        except (IOError, OSError, ValueError):
+            pass
+        self.agent.wait()
+        self.agent = None
+
+
+    def Write(self, data):
+        """Writes data to the standard input of the agent.
+        \param data A string.
+        """
+        self.lock.acquire()
+        try:
+            self.agent.stdin.write(data)
+            self.agent.stdin.flush()
+        finally:
+            self.lock.release()
+
+
+    def Send(self, message):
+        """Sends a request to the agent.
+        \param message A dictionary.
+        """
+        self.Write(json.dumps(message) + "\n")
+
+
+    def Launch(self, command, stdout = True, output_file = None):
+        """Launches a command through the agent.
+        \param command The command.
+        \param stdout Is the standard output kept? (True or False). The
+        standard error is always kept.
+        \param output_file A file object where the standard output and error
+        are written instead of being kept in memory.
+        @return An 'AgentProcess' instance.
+        """
+        self.lock.acquire()
+        try:
+            self.identifier += 1
+            identifier = self.identifier
+        finally:
+            self.lock.release()
+        process = AgentProcess(self, identifier, output_file)
+        self.process[identifier] = process
+        self.Send({"op": "launch", "id": identifier, "command": command,
+                   "stdout": stdout or output_file is not None})
+        return process
+
+
+    def Kill(self, identifier, signal_number = signal.SIGTERM):
+        """Sends a signal to a process launched through the agent.
+        \param identifier The identifier of the process.
+        \param signal_number The signal.
+        """
+        self.Send({"op": "kill", "id": identifier, "signal": signal_number})
+
+
+    def Read(self):
+        """Reads the notifications of the agent until it ends.
+        If the agent ends unexpectedly, the processes still running are
+        considered as failed (status 255, as SSH does).
+        """
+        while True:
+            line = self.agent.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            event = message.get("ev")
+            if event == "ready":
+                self.ready.set()
+                self.started.set()
+            elif event == "load":
+                self.uptime = message["uptime"]
+                self.used_memory = message["used_memory"]
+                self.sample_time = message["time"]
+                if self.callback is not None:
+                    self.callback(self.uptime, self.used_memory,
+                                  self.sample_time)
+            elif event in ["start", "output", "exit"]:
+                process = self.process.get(message["id"])
+                if process is not None:
+                    process.Notify(message)
+                if event == "exit":
+                    self.process.pop(message["id"], None)
+        # The agent ended: 'Start' does not wait any longer.
+        self.started.set()
+        for identifier in list(self.process.keys()):
+            self.process.pop(identifier).Notify({"ev": "exit",
+                                                 "status": 255,
+                                                 "time": time.time()})
+
+
+#################
+# AGENT PROCESS #
+#################
+
+
+class AgentProcess:
+    """A process launched through an agent.
+    It provides the methods 'poll', 'wait', 'communicate', 'terminate' and
+    'kill' of 'subprocess.Popen'.
+    """
+
+
+    def __init__(self, agent, identifier, output_file = None):
+        """Initializes the process.
+        \param agent The 'Agent' instance.
+        \param identifier The identifier of the process.
+        \param output_file A file object where the standard output and error
+        are written, or None.
+        """
+        ## The 'Agent' instance.
+        self.agent = agent
+
+        ## The identifier of the process.
+        self.identifier = identifier
+
+        ## The process ID on the host.
+        self.pid = None
+
+        ## The status of the process.
+        self.returncode = None
+
+        ## The starting date on the host.
+        self.beg_time = None
+
+        ## The ending date on the host.
+        self.end_time = None
+
+        ## The chunks of the standard output.
+        self.stdout = []
+
+        ## The chunks of the standard error.
+        self.stderr = []
+
+        ## The file object of the outputs, or None.
+        self.output_file = output_file
+
+        ## The maximum number of bytes kept for each output, or None. The
+        ## oldest chunks are dropped.
+        self.max_output = None
+
+        ## The number of kept bytes of each output.
+        self.length = {"stdout": 0, "stderr": 0}
+
+        ## Set when the process ends.
+        self.done = threading.Event()
+
+        ## The functions called when the process ends.
+        self.callback_list = []
+
+        ## A lock on the callbacks.
+        self.lock = threading.Lock()
+
+
+    def Notify(self, message):
+        """Processes a notification of the agent.
+        \param message The "start", "output" or "exit" notification.
+        """
+        if message["ev"] == "start":
+            self.pid = message["pid"]
+            self.beg_time = message["time"]
+        elif message["ev"] == "output":
+            data = base64.b64decode(message["data"])
+            if self.output_file is not None:
+                self.output_file.write(data)
+                self.output_file.flush()
+            else:
+                stream = message["stream"]
+                chunk = getattr(self, stream)
+                chunk.append(data)
+                self.length[stream] += len(data)
+                while self.max_output is not None and len(chunk) > 1 \
+                        and self.length[stream] > self.max_output:
+                    self.length[stream] -= len(chunk.pop(0))
+        elif message["ev"] == "exit":
+            self.lock.acquire()
+            try:
+                self.returncode = message["status"]
+                self.end_time = message["time"]
+                self.done.set()
+                callback_list = self.callback_list
+                self.callback_list = []
+            finally:
+                self.lock.release()
+            for callback in callback_list:
+                callback(self)
+
+
+    def AddCallback(self, callback):
+        """Adds a function called with the process when it ends.
+        The function is called at once if the process already ended.
+        \param callback The function.
+        """
+        self.lock.acquire()
+        try:
+            if not self.done.is_set():
+                self.callback_list.append(callback)
+                return
+        finally:
+            self.lock.release()
+        callback(self)
+
+
+    def poll(self):
+        """Returns the status of the process, or None if it is running.
+        """
+        return self.returncode
+
+
+    def wait(self):
+        """Waits for the end of the process and returns its status.
+        """
+        # A timeout keeps the wait interruptible.
+        while not self.done.is_set():
+            self.done.wait(60.)
+        return self.returncode
+
+
+    def communicate(self):
+        """Waits for the end of the process.
+        @return A tuple (standard output, standard error).
+        """
+        self.wait()
+        return "".join(self.stdout), "".join(self.stderr)
+
+
+    def send_signal(self, signal_number):
+        """Sends a signal to the process and to its children.
+        \param signal_number The signal.
+        """
+        if not self.done.is_set():
+            self.agent.Kill(self.identifier, signal_number)
+
+
+    def terminate(self):
+        """Terminates the process (SIGTERM).
+        """
+        self.send_signal(signal.SIGTERM)
+
+
+    def kill(self):
+        """Kills the process (SIGKILL).
+        """
+        self.send_signal(signal.SIGKILL)
+
+
+#########
+# BATCH #
+#########
+
+
+class Batch:
+    """A session which runs a batch of commands on a host.
+    The commands are launched at the same time by a shell script, without
+    agent: the host only needs a POSIX shell and the GNU core utilities. The
+    script notifies the starts and the ends of the commands with the dates of
+    the host, and sends the outputs of each command once it ended, truncated
+    on the host if required. The session ends with the last command.
+    """
+
+
+    def __init__(self, prefix = ""):
+        """Initializes the batch.
+        \param prefix The command which gives access to the host, such as
+        "ssh keats". An empty string stands for the local host.
+        """
+        ## The command which gives access to the host.
+        self.prefix = prefix
+
+        ## The 'subprocess.Popen' instance of the session.
+        self.session = None
+
+        ## The 'AgentProcess' instances indexed by their identifiers.
+        self.process = {}
+
+        ## A lock on the requests.
+        self.lock = threading.Lock()
+
+
+    def Launch(self, command_list, stdout = True, output_file_list = None,
+               max_output = None):
+        """Launches the commands.
+        \param command_list The list of commands.
+        \param stdout Are the standard outputs and errors kept? (True or
+        False). If not, they are not written on the host at all.
+        \param output_file_list The list of the file objects where the
+        standard output and error of each command are written instead of
+        being kept in memory, or None.
+        \param max_output The maximum number of bytes sent for each output,
+        or None for no limit. Only the end of each output is sent.
+        @return The list of 'AgentProcess' instances.
+        """
+        if output_file_list is None:
+            output_file_list = [None] * len(command_list)
+        else:
+            stdout = True
+        argument_list = []
+        for command in command_list:
+            if not isinstance(command, bytes):
+                command = command.encode()
+            argument_list.append(base64.b64encode(command).decode())
+        command = "sh -c " + shell_quote(__batch__) + " batch " \
+            + str(int(stdout)) + " " + str(int(max_output or 0)) + " " \
+            + " ".join(argument_list)
+        if self.prefix != "":
+            command = self.prefix + " " + shell_quote(command)
+        process_list = []
+        for i in range(len(command_list)):
+            process = AgentProcess(self, i + 1, output_file_list[i])
+            self.process[i + 1] = process
+            process_list.append(process)
+        devnull = open(os.devnull, 'w')
+        self.session = subprocess.Popen([command], shell = True,
+                                        stdin = subprocess.PIPE,
+                                        stdout = subprocess.PIPE,
+                                        stderr = devnull, close_fds = True)
+        devnull.close()
+        reader = threading.Thread(target = self.Read)
+        reader.daemon = True
+        reader.start()
+        return process_list
+
+
+    def Kill(self, identifier, signal_number = signal.SIGTERM):
+        """Sends a signal to a command of the batch and to its children.
+        \param identifier The identifier of the command.
+        \param signal_number The signal.
+        """
+        self.lock.acquire()
+        try:
+            self.session.stdin.write(("%i %i\n" % (identifier,
+                                                    signal_number)).encode())
+            self.session.stdin.flush()
+        except (IOError, OSError, ValueError):
+            # The session ended.
+            pass
+        finally:
+            self.lock.release()
+
+
+    def Read(self):
+        """Reads the notifications of the session until it ends.
+        If the session ends unexpectedly, the commands still running are
+        considered as failed (status 255, as SSH does).
+        """
+        while True:
+            line = self.session.stdout.readline()
+            if not line:
+                break
+            field = line.decode().split()
+            try:
+                process = self.process.get(int(field[1]))
+                if process is None:
+                    continue
+                if field[0] == "start":
+                    process.Notify({"ev": "start", "pid": int(field[2]),
+                                    "time": float(field[3])})
+                elif field[0] == "output":
+                    process.Notify({"ev": "output", "stream": field[2],
+                                    "data": field[3]})
+                elif field[0] == "exit":
+                    del self.process[int(field[1])]
+                    process.Notify({"ev": "exit", "status": int(field[2]),
+                                    "time": float(field[3])})
+            except (IndexError, ValueError):
+                continue
+        for identifier in list(self.process.keys()):
+            self.process.pop(identifier).Notify({"ev": "exit",
+                                                 "status": 255,
+                                                 "time": time.time()})
+        self.lock.acquire()
+        try:
+            self.session.stdin.close()
+        finally:
+            self.lock.release()
+        self.session.wait()
@@ -21,16 +21,12 @@ author Damien Garaud
 """
 
 import os
-import sys
 import commands
 import socket
 import popen2
 import subprocess
 
-
-########
-# HOST #
-########
+from puppetmaster import agent
 
 
 ## It may be written in a temporary SSH configuration file.
@@ -45,17 +41,140 @@ NoHostAuthenticationForLocalhost yes
 """
 
 
+## The probe of a host. It returns the connection, the number of processors,
+## the load averages and the memory information, with one line "key value"
+## for each quantity.
+__probe__ = "echo connection 1; " \
+    + "echo processor `grep -c ^processor /proc/cpuinfo`; " \
+    + "echo uptime `cut -d \" \" -f 1-3 /proc/loadavg`; " \
+    + "echo meminfo `grep -E \"^(MemTotal|MemFree|Buffers|Cached|" \
+    + "MemAvailable):\" /proc/meminfo`"
+
+
+###########################
+# MISCELLANEOUS FUNCTIONS #
+###########################
+
+
+def get_status_output(command):
+    """Runs a command in a shell, as 'commands.getstatusoutput' does.
+    The process may be reaped by another thread (see 'scheduler.Reaper'):
+    its status is then lost and reported as 0, while 'os.popen' would raise
+    an exception.
+    \param command The command.
+    @return A tuple (status, standard output and error without the trailing
+    newline).
+    """
+    process = subprocess.Popen([command], shell = True,
+                               stdout = subprocess.PIPE,
+                               stderr = subprocess.STDOUT)
+    out = process.communicate()[0]
+    if out[-1:] == "\n":
+        out = out[:-1]
+    return process.returncode, out
+
+
+def parse_meminfo(text):
+    """Parses the content of the file '/proc/meminfo'.
+    \param text The content of the file, or a part of it.
+    @return A dictionary of the quantities in kB.
+    """
+    field = text.split()
+    result = {}
+    for i in range(len(field) - 1):
+        if field[i].endswith(":"):
+            try:
+                result[field[i][:-1]] = int(field[i + 1])
+            except ValueError:
+                pass
+    return result
+
+
+def compute_used_memory(meminfo):
+    """Computes the used memory, without the buffers and the cache.
+    \param meminfo A dictionary from the function 'parse_meminfo'.
+    @return The used memory in kB.
+    """
+    if meminfo.has_key("MemAvailable"):
+        return meminfo["MemTotal"] - meminfo["MemAvailable"]
+    return meminfo["MemTotal"] - meminfo["MemFree"] \
+        - meminfo.get("Buffers", 0) - meminfo.get("Cached", 0)
+
+
+def read_meminfo():
+    """Reads the memory information of the local host.
+    @return A dictionary from the function 'parse_meminfo'.
+    """
+    meminfo_file = open("/proc/meminfo", 'r')
+    text = meminfo_file.read()
+    meminfo_file.close()
+    return parse_meminfo(text)
+
+
+def read_load_average():
+    """Reads the load averages of the local host.
+    @return A list of floats (1, 5 and 15 minutes).
+    """
+    loadavg_file = open("/proc/loadavg", 'r')
+    text = loadavg_file.read()
+    loadavg_file.close()
+    return [float(x) for x in text.split()[:3]]
+
+
+def parse_cpu_list(text):
+    """Counts the processors of a list such as the field
+    'Cpus_allowed_list' of the file '/proc/self/status'.
+    \param text The list of processors, such as "0-3,6".
+    @return An integer.
+    """
+    Nprocessor = 0
+    for cpu_range in text.strip().split(","):
+        bound = cpu_range.split("-")
+        Nprocessor += int(bound[-1]) - int(bound[0]) + 1
+    return Nprocessor
+
+
+def read_processor_number():
+    """Reads the number of processors available for the local process.
+    The affinity of the process is taken into account.
+    @return An integer.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    # The affinity, such as "0-3,6".
+    status_file = open("/proc/self/status", 'r')
+    status = status_file.readlines()
+    status_file.close()
+    for line in status:
+        if line.startswith("Cpus_allowed_list:"):
+            return parse_cpu_list(line.split(":")[1])
+    # The lines "cpuN" in '/proc/stat'.
+    stat_file = open("/proc/stat", 'r')
+    stat = stat_file.readlines()
+    stat_file.close()
+    return len([x for x in stat if x.startswith("cpu")
+                and x[3:4].isdigit()])
+
+
+########
+# HOST #
+########
+
+
 class Host:
     """Dedicated to host management."""
 
 
-    def __init__(self, host = socket.gethostname(),
-                 forced_ssh_config = False):
+    def __init__(self, host = None, forced_ssh_config = False,
+                 multiplex = True):
         """The constructor.
         Initializes the attributes and checks the SSH connection to the host.
-        ``host`` The name of the host.
+        ``host`` The name of the host. The local host by default.
         ``forced_ssh_config`` Would like to use the PuppetMaster SSH
         configuration? (True or False). See the variable ``__sshconfig__``.
+        ``multiplex`` Would like to share a single SSH connection between all
+        commands launched on the host? (True or False). See the method
+        ``OpenMaster``.
         """
 
         ## Name of the host.
@@ -67,9 +186,27 @@ class Host:
         ## The total memory.
         self.total_memory = 0
 
+        ## The load averages from the last probe (or "off").
+        self.uptime = "off"
+
+        ## The used memory from the last probe (or "off").
+        self.used_memory = "off"
+
+        ## The date of the last probe.
+        self.probe_time = None
+
         ## Connection failed?
         self.connection = False
 
+        ## The control socket of the SSH master connection.
+        self.control_path = None
+
+        ## The SSH command without multiplexing.
+        self.ssh_direct = None
+
+        ## The 'agent.Agent' instance running on the host, or None.
+        self.agent = None
+
         ## The default SSH command.
         self.ssh = "ssh "
         if forced_ssh_config:
@@ -80,33 +217,39 @@ class Host:
             self.ssh = "ssh -F /tmp/ssh-config-puppet "
 
         # Checks type argument.
+        if host is None:
+            host = socket.gethostname()
         self.CheckArgument(host)
 
-        # Checks SSH connection. Changed the SSH command if necessary.
-        try:
-            self.CheckSSH()
-        except SystemError:
+        # Checks SSH connection and probes the host in a single round
+        # trip. Changed the SSH command if necessary.
+        if multiplex:
+            self.OpenMaster()
+        if self.Probe() is None and self.name != socket.gethostname():
             if not os.path.isfile('/tmp/ssh-config-puppet'):
                 ssh_file = open('/tmp/ssh-config-puppet', 'w')
                 ssh_file.writelines(__sshconfig__)
                 ssh_file.close()
+            self.CloseMaster()
             self.ssh = "ssh -F /tmp/ssh-config-puppet "
-            try:
-                self.CheckSSH()
-            except SystemError:
-                self.connection = False
-
-        if self.connection:
-            # Gets the number of processors.
-            self.GetProcessorNumber()
-            # Get the total memory.
-            self.GetTotalMemory()
+            if multiplex:
+                self.OpenMaster()
+            self.Probe()
 
 
     def __del__(self):
         """The destructor.
-        Deletes the temporary SSH configuration file.
+        Stops the agent, closes the SSH master connection and deletes the
+        temporary SSH configuration file.
         """
+        try:
+            self.StopAgent()
+        except:
+            pass
+        try:
+            self.CloseMaster()
+        except:
+            pass
         try:
             if os.path.isfile('/tmp/ssh-config-puppet'):
                 os.remove('/tmp/ssh-config-puppet')
@@ -114,6 +257,112 @@ class Host:
             pass
 
 
+    def OpenMaster(self):
+        """Opens the SSH master connection to the host.
+        The master connection runs in the background. Every following SSH
+        command (probes and launchings) goes through it and avoids a new
+        handshake. If the master connection is lost, the SSH commands connect
+        to the host as usual. Nothing is done for the local host.
+        @return True if the master connection is open, False otherwise.
+        """
+        if self.control_path is not None:
+            return True
+        if self.name == socket.gethostname():
+            return False
+        import tempfile
+        # A directory of its own, so that two instances for the same host
+        # do not share the socket.
+        control_path = os.path.join(tempfile.mkdtemp(prefix = 'puppet-ssh-'),
+                                    self.name)
+        command_name = self.ssh + "-o ControlMaster=yes -o ControlPath=" \
+            + control_path + " -f -N " + self.name
+        devnull = open(os.devnull, 'r+')
+        status = subprocess.call([command_name], shell = True,
+                                 stdin = devnull, stdout = devnull,
+                                 stderr = devnull)
+        devnull.close()
+        if status != 0:
+            try:
+                os.rmdir(os.path.dirname(control_path))
+            except OSError:
+                pass
+            return False
+        self.control_path = control_path
+        self.ssh_direct = self.ssh
+        self.ssh = self.ssh + "-o ControlMaster=no -o ControlPath=" \
+            + control_path + " "
+        return True
+
+
+    def CloseMaster(self):
+        """Closes the SSH master connection to the host.
+        The following SSH commands connect to the host as usual.
+        """
+        if self.control_path is None:
+            return
+        command_name = self.ssh + "-O exit " + self.name
+        devnull = open(os.devnull, 'r+')
+        subprocess.call([command_name], shell = True, stdin = devnull,
+                        stdout = devnull, stderr = devnull)
+        devnull.close()
+        try:
+            if os.path.exists(self.control_path):
+                os.remove(self.control_path)
+            os.rmdir(os.path.dirname(self.control_path))
+        except OSError:
+            pass
+        self.ssh = self.ssh_direct
+        self.control_path = None
+
+
+    def StartAgent(self, interval = 10., python = None):
+        """Starts an agent on the host.
+        The agent runs over a single SSH session. Then 'LaunchSubProcess'
+        launches the commands through the agent, which notifies their ends
+        with the dates of the host, and the load averages and the used memory
+        are updated every 'interval' seconds without any probe. See the
+        module 'agent'.
+        \param interval The period of time between two load samples (in
+        seconds).
+        \param python The Python interpreter on the host. By default, the
+        current interpreter for the local host and "python" otherwise.
+        @return True if the agent is running, False otherwise.
+        """
+        if self.agent is not None and self.agent.IsAlive():
+            return True
+        if self.name == socket.gethostname():
+            prefix = ""
+        else:
+            prefix = self.ssh + self.name
+        self.agent = agent.Agent(prefix, python, interval, self.SetSample)
+        if not self.agent.Start():
+            self.agent = None
+            return False
+        return True
+
+
+    def StopAgent(self):
+        """Stops the agent of the host, if any.
+        The commands still running through the agent are killed.
+        """
+        if self.agent is None:
+            return
+        self.agent.Stop()
+        self.agent = None
+
+
+    def SetSample(self, uptime, used_memory, sample_time):
+        """Updates the load averages and the used memory with a sample of the
+        agent.
+        \param uptime The load averages (or "off").
+        \param used_memory The used memory in kB (or "off").
+        \param sample_time The date of the sample.
+        """
+        self.uptime = uptime
+        self.used_memory = used_memory
+        self.probe_time = sample_time
+
+
     def CheckArgument(self, host):
         """
         Checks the argument::
@@ -163,7 +412,7 @@ class Host:
         else:
             # SSH 'pwd' test.
             command_name = self.ssh + self.name + " pwd 2> /dev/null"
-            status, out = commands.getstatusoutput(command_name)
+            status, out = get_status_output(command_name)
             if status != 0 or len(out) == 0:
                 self.connection = False
                 raise SystemError
@@ -171,6 +420,67 @@ class Host:
                 self.connection = True
 
 
+    def Probe(self):
+        """Probes the host with a single command.
+        Checks the connection and updates the number of processors (unless
+        it was given), the total memory, the load averages and the used
+        memory. See the variable ``__probe__``. For the local host, the files
+        in '/proc' are read directly.
+        @return A dictionary with the keys 'processor', 'total_memory',
+        'uptime' and 'used_memory', or None if the connection failed.
+        """
+        import time
+        # If the host is the localhost.
+        if self.name == socket.gethostname():
+            self.connection = True
+            result = {"processor": read_processor_number()}
+            try:
+                meminfo = read_meminfo()
+                result["total_memory"] = meminfo["MemTotal"]
+                result["used_memory"] = compute_used_memory(meminfo)
+            except (IOError, KeyError):
+                result["used_memory"] = "off"
+            try:
+                result["uptime"] = read_load_average()
+            except (IOError, ValueError):
+                result["uptime"] = "off"
+        else:
+            command_name = self.ssh + self.name + " '" + __probe__ \
+                + "' 2>/dev/null"
+            status, out = get_status_output(command_name)
+            reply = {}
+            for line in out.split('\n'):
+                field = line.split()
+                if len(field) > 1:
+                    reply[field[0]] = field[1:]
+            if status != 0 or not reply.has_key("connection"):
+                self.connection = False
+                return None
+            self.connection = True
+            result = {}
+            try:
+                result["processor"] = int(reply["processor"][0])
+            except (KeyError, ValueError):
+                pass
+            try:
+                result["uptime"] = [float(x) for x in reply["uptime"][:3]]
+            except (KeyError, ValueError):
+                result["uptime"] = "off"
+            try:
+                meminfo = parse_meminfo(" ".join(reply["meminfo"]))
+                result["total_memory"] = meminfo["MemTotal"]
+                result["used_memory"] = compute_used_memory(meminfo)
+            except KeyError:
+                result["used_memory"] = "off"
+        if self.Nprocessor == 0:
+            self.Nprocessor = result.get("processor", 0)
+        self.total_memory = result.get("total_memory", self.total_memory)
+        self.uptime = result["uptime"]
+        self.used_memory = result["used_memory"]
+        self.probe_time = time.time()
+        return result
+
+
     def GetProcessorNumber(self):
         """Returns the number of processors.
         @return An integer.
@@ -178,29 +488,14 @@ class Host:
         if self.Nprocessor != 0:
             return self.Nprocessor
         else:
-            command_name = " cat /proc/cpuinfo | grep ^processor | wc -l"
             # If the host is the localhost.
             if self.name == socket.gethostname():
-                status, out = commands.getstatusoutput(command_name)
-                # The command must be returned a non-zero status and a single
-                # line.
-                if status != 0 or len(out.split('\n')) != 1:
-                    print("The command '%s' returns the status '%i'" %
-                          (command_name, status))
-                    print("with the message:")
-                    print("%s" % out)
-                    sys.exit(0)
+                self.Nprocessor = read_processor_number()
+            elif self.connection:
+                command_name = self.ssh + self.name + " 2>/dev/null" \
+                    + " cat /proc/cpuinfo | grep ^processor | wc -l"
+                status, out = get_status_output(command_name)
                 self.Nprocessor = int(out)
-            else:
-                try:
-                    self.CheckSSH()
-                except SystemError:
-                    pass
-                if self.connection:
-                    command_name = self.ssh + self.name + " 2>/dev/null"\
-                        + command_name
-                    status, out = commands.getstatusoutput(command_name)
-                    self.Nprocessor = int(out)
             return self.Nprocessor
 
 
@@ -211,32 +506,15 @@ class Host:
         if self.total_memory != 0:
             return self.total_memory
         else:
-            command_name = " cat /proc/meminfo | grep ^MemTotal " \
-                + "| cut -d : -f 2"
             # If the host is the localhost.
             if self.name == socket.gethostname():
-                status, out = commands.getstatusoutput(command_name)
-                # The command must be returned a non-zero status and a single
-                # line.
-                if status != 0 or len(out.split('\n')) != 1:
-                    print("The command '%s' returns the status '%i'" %
-                          (command_name, status))
-                    print("with the message:")
-                    print("%s" % out)
-                    sys.exit(0)
+                self.total_memory = read_meminfo()["MemTotal"]
+            elif self.connection:
+                command_name = self.ssh + self.name + " 2>/dev/null" \
+                    + " cat /proc/meminfo | grep ^MemTotal | cut -d : -f 2"
+                status, out = get_status_output(command_name)
                 self.total_memory = int(out.split()[0])
-                return self.total_memory
-            else:
-                try:
-                    self.CheckSSH()
-                except SystemError:
-                    pass
-                if self.connection:
-                    command_name = self.ssh + self.name + " 2>/dev/null" \
-                        + command_name
-                    status, out = commands.getstatusoutput(command_name)
-                    self.total_memory = int(out.split()[0])
-                return self.total_memory
+            return self.total_memory
 
 
     def GetUptime(self):
@@ -244,18 +522,19 @@ class Host:
         minutes).
         @return A list of floats or a string if the connection failed.
         """
-        command_name = " uptime"
         # If the host is the localhost.
         if self.name == socket.gethostname():
-            status, out = commands.getstatusoutput(command_name)
-            # The command must be returned a non-zero status and a single
-            # line.
-            if status != 0 or len(out.split('\n')) != 1:
-                print("The command '%s' returns the status '%i'" %
-                      (command_name, status))
-                print("with the message:")
-                print("%s" % out)
-                sys.exit(0)
+            try:
+                return read_load_average()
+            except (IOError, ValueError):
+                return "off"
+        else:
+            try:
+                self.CheckSSH()
+            except SystemError:
+                return "off"
+            command_name = self.ssh + self.name + " 2>/dev/null uptime"
+            status, out = get_status_output(command_name)
             try:
                 out = out.split()
                 out = [float(x.strip(",")) for x in out[-3:]]
@@ -263,62 +542,32 @@ class Host:
                 # Connection failed?
                 out = "off"
             return out
-        else:
-            try:
-                self.CheckSSH()
-            except SystemError:
-                return "off"
-            if self.connection:
-                command_name = self.ssh + self.name + " 2>/dev/null" \
-                    + command_name
-                status, out = commands.getstatusoutput(command_name)
-                try:
-                    out = out.split()
-                    out = [float(x.strip(",")) for x in out[-3:]]
-                except:
-                    # Connection failed?
-                    out = "off"
-                return out
 
 
     def GetUsedMemory(self):
-        """Returns the used memory (kB by default).
+        """Returns the used memory (kB by default), without the buffers and
+        the cache.
         @return An integer or a string if the connection failed.
         """
-        command_name = " free | cut -d : -f 2"
         # If the host is the localhost.
         if self.name == socket.gethostname():
-            status, out = commands.getstatusoutput(command_name)
-            # The command must be returned a non-zero status.
-            if status != 0:
-                print("The command '%s' returns the status '%i'" %
-                      (command_name, status))
-                print("with the message:")
-                print("%s" % out)
-                sys.exit(0)
             try:
-                out = out.split('\n')[2]
-                out = int(out.split()[0])
-            except:
-                # Connection failed?
-                out = "off"
-            return out
+                return compute_used_memory(read_meminfo())
+            except (IOError, KeyError):
+                return "off"
         else:
             try:
                 self.CheckSSH()
             except SystemError:
                 return "off"
-            if self.connection:
-                command_name = self.ssh + self.name + " 2>/dev/null" \
-                    + command_name
-            status, out = commands.getstatusoutput(command_name)
+            command_name = self.ssh + self.name \
+                + " 2>/dev/null cat /proc/meminfo"
+            status, out = get_status_output(command_name)
             try:
-                out = out.split('\n')[2]
-                out = int(out.split()[0])
-            except:
+                return compute_used_memory(parse_meminfo(out))
+            except KeyError:
                 # Connection failed?
-                out = "off"
-            return out
+                return "off"
 
 
     def LaunchInt(self, command):
@@ -362,6 +611,9 @@ class Host:
         """Launches a command in the background with the module 'subprocess'.
         The standard output and error can be called with
         'subprocess.Popen.communicate()' method when the process terminated.
+        If an agent runs on the host, the command is launched through it and
+        an 'agent.AgentProcess' instance is returned instead of the
+        'subprocess.Popen' instance.
         \param command The name of the command.
         \param outo_ption A string.
           - None: writes the standard output in '/dev/null'.
@@ -375,6 +627,15 @@ class Host:
         # Checks 'out_option'.
         if out_option not in [None, 'pipe', 'file']:
             out_option = None
+        # If an agent runs on the host.
+        if self.agent is not None and self.agent.IsAlive():
+            if out_option == 'file':
+                filename = tempfile.mkstemp(prefix = 'puppet-'
+                                            + self.name + '-')[1]
+                outfile = open(filename, 'w+')
+                return outfile, self.agent.Launch(command,
+                                                  output_file = outfile)
+            return self.agent.Launch(command, out_option == 'pipe')
         # If host is the local host.
         if self.name == socket.gethostname():
             if out_option == 'pipe':
@@ -418,6 +679,46 @@ class Host:
                                         stderr = subprocess.PIPE)
 
 
+    def LaunchBatch(self, command_list, out_option = None, max_output = None):
+        """Launches several commands in the background over a single
+        session.
+        The commands run at the same time on the host, and each command is
+        followed on its own (see 'agent.Batch'). If an agent runs on the
+        host, the commands are launched through it.
+        \param command_list The list of commands.
+        \param out_option A string.
+          - None: writes the standard outputs and errors in '/dev/null'.
+          - 'pipe': keeps the standard outputs and errors in memory.
+          - 'file': writes the standard outputs and errors in files such as
+            '/tmp/puppet-hostname-erTfZ'.
+        \param max_output The maximum number of bytes kept for each output
+        with the option 'pipe', or None for no limit. The outputs are
+        truncated on the host.
+        @return A list of 'agent.AgentProcess' instances, or of tuples (file
+        object, 'agent.AgentProcess') when the 'out_option' is set to
+        'file'.
+        """
+        import tempfile
+        if self.agent is not None and self.agent.IsAlive():
+            return [self.LaunchSubProcess(x, out_option)
+                    for x in command_list]
+        if self.name == socket.gethostname():
+            batch = agent.Batch()
+        else:
+            batch = agent.Batch(self.ssh + self.name)
+        if out_option == 'file':
+            file_list = []
+            for i in range(len(command_list)):
+                descriptor, filename = \
+                    tempfile.mkstemp(prefix = 'puppet-' + self.name + '-')
+                os.close(descriptor)
+                file_list.append(open(filename, 'w+'))
+            return zip(file_list, batch.Launch(command_list,
+                                               output_file_list = file_list))
+        return batch.Launch(command_list, out_option == 'pipe',
+                            max_output = max_output)
+
+
     def LaunchWait(self, command, ltime, wait = 0.1):
         """Launches a command in the background and waits for its output for a
         given time after which the process is killed.
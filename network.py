@@ -23,7 +23,9 @@ network.
 """
 
 import os
+import time
 import types
+import Queue
 import socket
 import threading
 
@@ -99,16 +101,42 @@ class Network:
     """
 
 
-    def __init__(self, host_list = None, forced_ssh_config = False):
+    def __init__(self, host_list = None, forced_ssh_config = False,
+                 multiplex = True, Nthread = 32, timeout = 60.):
         """Initiliazes the list of hosts.
         \param host_list A list of host instances, host names or a file.
         \param forced_ssh_config Would like to use the PuppetMaster SSH
         configuration? (True or False). See the variable 'host.__sshconfig__'.
+        \param multiplex Would like to share a single SSH connection between
+        all commands launched on a host? (True or False). See the method
+        'host.Host.OpenMaster'. The connections are closed by the method
+        'Close'.
+        \param Nthread The maximum number of threads used to send requests
+        to the hosts.
+        \param timeout The time limit of a request to a host (in seconds).
         """
 
         ## The hosts list.
         self.hosts = []
 
+        ## The 'host.Host' instances indexed by their names.
+        self.host_index = {}
+
+        ## A 'ThreadPool' instance.
+        self.pool = ThreadPool(Nthread)
+
+        ## The time limit of a request to a host.
+        self.timeout = timeout
+
+        ## Are SSH connections multiplexed?
+        self.multiplex = multiplex
+
+        ## A 'ThreadMonitor' instance, or None.
+        self.monitor = None
+
+        ## Are agents running on the hosts?
+        self.agent = False
+
         self.CheckArgument(host_list, forced_ssh_config)
 
         # Empty connected hosts list?
@@ -116,6 +144,26 @@ class Network:
             raise ValueError, "The list of connected hosts list is empty."
 
 
+    def __del__(self):
+        """The destructor.
+        Closes the SSH master connections.
+        """
+        try:
+            self.Close()
+        except:
+            pass
+
+
+    def Close(self):
+        """Stops the host monitor and the agents, and closes the SSH master
+        connections to the hosts.
+        """
+        self.StopMonitor()
+        self.StopAgent()
+        for host_ in self.hosts:
+            host_.CloseMaster()
+
+
     def CheckArgument(self, host_list, forced_ssh_config):
         """Checks the argument.
         \param host_list A list of host instances, host names or a file.
@@ -124,7 +172,8 @@ class Network:
         """
         # The local host by default.
         if host_list == None:
-            self.hosts = [host.Host(socket.gethostname())]
+            self.hosts = [host.Host(socket.gethostname(),
+                                    multiplex = self.multiplex)]
         # A list of hosts (name or instance).
         elif isinstance(host_list, list):
             self.CheckArgumentHostList(host_list, forced_ssh_config)
@@ -134,6 +183,38 @@ class Network:
         else:
             raise ValueError, "The argument must be a list of hosts" \
                 + " or a file."
+        self.IndexHosts()
+
+
+    def IndexHosts(self):
+        """Indexes the hosts by their names.
+        If several hosts have the same name, the first one is indexed.
+        """
+        self.host_index = {}
+        for host_ in self.hosts:
+            if not self.host_index.has_key(host_.name):
+                self.host_index[host_.name] = host_
+
+
+    def GetHost(self, host_ = None):
+        """Returns a host of the list.
+        \param host_ The name of the host or a 'host.Host' instance. The
+        local host by default.
+        @return The 'host.Host' instance.
+        """
+        if host_ is None:
+            host_ = socket.gethostname()
+        # A 'Host' instance.
+        if isinstance(host_, host.Host):
+            if not self.host_index.has_key(host_.name):
+                raise ValueError, "The host name '%s' not " % host_.name \
+                    + "found in the list of hosts."
+            return host_
+        # The name of a host.
+        if not self.host_index.has_key(host_):
+            raise ValueError, "The host name '%s' not found " % host_ \
+                + "in the list of hosts."
+        return self.host_index[host_]
 
 
     def CheckArgumentHostList(self, host_list, forced_ssh_config):
@@ -172,10 +253,15 @@ class Network:
 
     def SetHostList(self, host_list, forced_ssh_config):
         """Sets a new list of hosts.
+        The SSH master connections of the former hosts are closed.
         \param host_list A list of host instances, host names or a file.
         """
+        former_hosts = self.hosts
         self.hosts = []
         self.CheckArgument(host_list, forced_ssh_config)
+        for host_ in former_hosts:
+            if host_ not in self.hosts:
+                host_.CloseMaster()
         # Empty connected hosts list?
         if self.GetConnectedHostNumber() == 0:
             raise ValueError, "The list of connected hosts list is empty."
@@ -226,80 +312,203 @@ class Network:
         return result
 
 
+    def GetTotalMemory(self):
+        """Returns the total memory of each host (kB).
+        @return A list of tuples (hostname, total memory)
+        """
+        result = []
+        for host_ in self.hosts:
+            result.append((host_.name, host_.total_memory))
+        return result
+
+
     def GetThreadHost(self, host_list, forced_ssh_config = False):
         """Creates 'host.Host' instances with multi-threading.
+        The hosts which do not answer before the time limit are discarded.
         \param host_list A list of host names.
         \param forced_ssh_config Would like to use the PuppetMaster SSH
         configuration? (True or False). See the variable 'host.__sshconfig__'.
         """
-        processus_list = []
-        # Launches all threads.
+        def create(hostname):
+            return host.Host(hostname, forced_ssh_config, self.multiplex)
+        host_list = [x for x in host_list if len(x) != 0]
+        instance = {}
+        for hostname, host_ in self.pool.Map(create, host_list,
+                                             self.timeout):
+            if host_ is None:
+                print "The host '%s' did not answer in time." % hostname
+            else:
+                instance[hostname] = host_
+        # Keeps the order of the list.
         for hostname in host_list:
-            if len(hostname) != 0:
-                thread_host = ThreadHost(hostname, forced_ssh_config)
-                processus_list.append(thread_host)
-                thread_host.start()
-        # Gets the results.
-        for processus in processus_list:
-            processus.join()
-            self.hosts.append(processus.host_instance)
+            if instance.has_key(hostname):
+                self.hosts.append(instance[hostname])
 
 
     def GetUptime(self):
         """Returns the output of the Unix command 'uptime' for each host.
         Launches the command 'uptime' to each host with multi-threading.
-        @return A list of tuples (hostname, uptime).
+        @return A list of tuples (hostname, uptime), in the order the hosts
+        answered.
         """
-        processus_list = []
-        result = []
-        # Launches all threads.
-        for host_instance in self.hosts:
-            thread_uptime = ThreadUptime(host_instance)
-            processus_list.append(thread_uptime)
-            thread_uptime.start()
-        # Gets the results.
-        for processus in processus_list:
-            processus.join()
-            result.append((processus.hostname, processus.uptime))
-        return result
+        def uptime(host_):
+            return host_.GetUptime()
+        return [(x[0].name, x[1]) for x in
+                self.pool.Map(uptime, self.hosts, self.timeout, "off")]
 
 
     def GetUsedMemory(self):
         """Returns the used memory for each host (kB).
         Launches the Unix command 'free' to each host with multi-threading.
-        @return A list of tuples (hostname, used memory).
+        @return A list of tuples (hostname, used memory), in the order the
+        hosts answered.
+        """
+        def used_memory(host_):
+            return host_.GetUsedMemory()
+        return [(x[0].name, x[1]) for x in
+                self.pool.Map(used_memory, self.hosts, self.timeout, "off")]
+
+
+    def StartMonitor(self, interval = 10.):
+        """Starts to monitor the hosts in the background.
+        Every 'interval' seconds, each host is probed (see
+        'host.Host.Probe') and its load averages and its used memory are
+        updated. Then the method 'GetAvailableHosts' reads the latest values
+        instead of sending requests to the hosts.
+        \param interval The period of time between two probes of a host (in
+        seconds).
         """
-        processus_list = []
+        self.StopMonitor()
+        self.monitor = ThreadMonitor(self, interval)
+        self.monitor.start()
+
+
+    def StopMonitor(self):
+        """Stops to monitor the hosts in the background.
+        """
+        if self.monitor is not None:
+            self.monitor.Stop()
+            self.monitor = None
+
+
+    def StartAgent(self, interval = 10., python = None):
+        """Starts an agent on each host with multi-threading.
+        The commands are then launched through the agents, and the method
+        'GetAvailableHosts' reads the load averages sent by the agents every
+        'interval' seconds. See the method 'host.Host.StartAgent'.
+        \param interval The period of time between two load samples (in
+        seconds).
+        \param python The Python interpreter on the hosts.
+        @return The list of the names of the hosts where the agent could not
+        be started.
+        """
+        def start(host_):
+            return host_.StartAgent(interval, python)
+        self.agent = True
+        return [x[0].name for x in
+                self.pool.Map(start, self.hosts, self.timeout, False)
+                if not x[1]]
+
+
+    def StopAgent(self):
+        """Stops the agents of the hosts.
+        """
+        if not self.agent:
+            return
+        def stop(host_):
+            host_.StopAgent()
+        for result in self.pool.Map(stop, self.hosts, self.timeout):
+            pass
+        self.agent = False
+
+
+    def GetSnapshot(self):
+        """Returns the latest values from the host probes.
+        @return A list of tuples (hostname, uptime, used memory, age) where
+        'age' is the time elapsed since the probe (in seconds).
+        """
+        current_time = time.time()
         result = []
-        # Launches all threads.
-        for host_instance in self.hosts:
-            thread_memory = ThreadUsedMemory(host_instance)
-            processus_list.append(thread_memory)
-            thread_memory.start()
-        # Gets the results.
-        for processus in processus_list:
-            processus.join()
-            result.append((processus.hostname, processus.used_memory))
+        for host_ in self.hosts:
+            if host_.probe_time is None:
+                result.append((host_.name, "off", "off", None))
+            else:
+                result.append((host_.name, host_.uptime, host_.used_memory,
+                               current_time - host_.probe_time))
         return result
 
 
-    def GetAvailableHosts(self):
+    def GetAvailableHosts(self, running = None, with_age = False):
         """Returns the available hosts.
         @return a list of hosts in a tuple with the number of available
         cpu. The computation is done with the system load averages for the
-        past 1 minute. See the Unix command 'uptime'.
-        @return A list of tuples (hostname, available cpu).
+        past 1 minute. See the Unix command 'uptime'. If the host monitor is
+        running (see 'StartMonitor'), the latest load averages are read and
+        no request is sent to the hosts. The same holds if agents run on the
+        hosts (see 'StartAgent').
+        \param running A dictionary which gives, for each host name, the
+        number of programs launched by PuppetMaster and still running. The
+        load average lags behind the launchings: these programs are counted
+        as busy processors even if the load average does not show them yet,
+        and a host never gets more programs than its number of processors.
+        \param with_age Would like to know the age of the load averages?
+        (True or False).
+        @return A list of tuples (hostname, available cpu), or (hostname,
+        available cpu, age) if 'with_age' is True, where 'age' is the time
+        elapsed since the load averages were measured (in seconds).
         """
-        uptime_list = self.GetUptime()
+        if running is None:
+            running = {}
+        if self.monitor is not None or self.agent:
+            uptime_list = [(x[0], x[1], x[3]) for x in self.GetSnapshot()]
+        else:
+            uptime_list = [(x[0], x[1], 0.) for x in self.GetUptime()]
+        uptime_index = dict([(x[0], x[1:]) for x in uptime_list])
         result = []
         # A loop for every hosts to pick up the number of available cpu.
         for host_ in self.hosts:
-            index = [x[0] for x in uptime_list].index(host_.name)
-            if host_.connection:
-                average = uptime_list[index][1][0]
-                if average < host_.Nprocessor - 0.5:
-                    result.append((host_.name, int(host_.Nprocessor
-                                                   - average + 0.5)))
+            uptime, age = uptime_index[host_.name]
+            if host_.connection and uptime != "off":
+                Nrunning = min(running.get(host_.name, 0), host_.Nprocessor)
+                # The load due to the other users.
+                external = max(0., uptime[0] - Nrunning)
+                Ncpu = min(int(host_.Nprocessor - Nrunning - external + 0.5),
+                           host_.Nprocessor - Nrunning)
+                if Ncpu > 0 and with_age:
+                    result.append((host_.name, Ncpu, age))
+                elif Ncpu > 0:
+                    result.append((host_.name, Ncpu))
+        return result
+
+
+    def GetAvailableMemory(self, reserved = None):
+        """Returns the available memory of each host (kB).
+        If the host monitor or the agents are running (see 'StartMonitor'
+        and 'StartAgent'), the latest used memory is read and no request is
+        sent to the hosts.
+        \param reserved A dictionary which gives, for each host name, the
+        memory reserved by the programs launched by PuppetMaster and still
+        running (kB). The reserved memory is not available, even if these
+        programs do not use it yet.
+        @return A list of tuples (hostname, available memory), for the hosts
+        whose memory is known.
+        """
+        if reserved is None:
+            reserved = {}
+        if self.monitor is not None or self.agent:
+            used_index = dict([(x[0], x[2]) for x in self.GetSnapshot()])
+        else:
+            used_index = dict(self.GetUsedMemory())
+        result = []
+        for host_ in self.hosts:
+            used = used_index.get(host_.name, "off")
+            if host_.connection and used != "off" \
+                    and host_.total_memory != 0:
+                ours = reserved.get(host_.name, 0)
+                # The memory used by the other users.
+                external = max(0, used - ours)
+                result.append((host_.name, max(0, host_.total_memory - ours
+                                               - external)))
         return result
 
 
@@ -319,74 +528,44 @@ class Network:
         return host_list
 
 
-    def LaunchInt(self, command, host_ = socket.gethostname()):
+    def LaunchInt(self, command, host_ = None):
         """Launches a command in interactive mode (using os.system).
         \param command The name of the command.
-        \param host_ The name of the host or a 'host.Host' instance.
+        \param host_ The name of the host or a 'host.Host' instance. The
+        local host by default.
         @return The status of the command.
         """
-        # The name of a host.
-        if isinstance(host_, str):
-            if host_ not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not found " % host_ \
-                    + "in the list of hosts."
-            index = [x.name for x in self.hosts].index(host_)
-            return self.hosts[index].LaunchInt(command)
-        # A 'Host' instance.
-        if isinstance(host_, host.Host):
-            if host_.name not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not " % host_.name \
-                    + "found in the list of hosts."
-            return host_.LaunchInt(command)
+        return self.GetHost(host_).LaunchInt(command)
 
 
-    def LaunchFG(self, command, host_ = socket.gethostname()):
+    def LaunchFG(self, command, host_ = None):
         """Launches a command in the foreground.
         \param command The name of the command.
-        \param host_ The name of the host or a 'host.Host' instance.
+        \param host_ The name of the host or a 'host.Host' instance. The
+        local host by default.
         @return The output and the status of the command in a tuple.
         """
-        # The name of a host.
-        if isinstance(host_, str):
-            if host_ not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not found " % host_ \
-                    + "in the list of hosts."
-            index = [x.name for x in self.hosts].index(host_)
-            return self.hosts[index].LaunchFG(command)
-        # A 'Host' instance.
-        if isinstance(host_, host.Host):
-            if host_.name not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not " % host_.name \
-                    + "found in the list of hosts."
-            return host_.LaunchFG(command)
+        return self.GetHost(host_).LaunchFG(command)
 
 
-    def LaunchBG(self, command, host_ = socket.gethostname()):
+    def LaunchBG(self, command, host_ = None):
         """Launches a command in the background.
         \param command The name of the command.
-        \param host_ The name of the host or a 'host.Host' instance.
+        \param host_ The name of the host or a 'host.Host' instance. The
+        local host by default.
         @return A Popen4 object.
         """
-        if isinstance(host_, str):
-            if host_ not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not found " % host_ \
-                    + "in the list of hosts."
-            index = [x.name for x in self.hosts].index(host_)
-            return self.hosts[index].LaunchBG(command)
-        if isinstance(host_, host.Host):
-            if host_.name not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not " % host_.name \
-                    + "found in the list of hosts."
-            return host_.LaunchBG(command)
+        return self.GetHost(host_).LaunchBG(command)
 
 
-    def LaunchSubProcess(self, command, host_ = socket.gethostname(),
+    def LaunchSubProcess(self, command, host_ = None,
                          out_option = None):
         """Launches a command in the background with the module 'subprocess'.
         The standard output and error can be called with
         'subprocess.Popen.communicate()' method when the process terminated.
         \param command The name of the command.
-        \param host_ The name of the host or a 'host.Host' instance.
+        \param host_ The name of the host or a 'host.Host' instance. The
+        local host by default.
         \param outo_ption A string.
           - None: writes the standard output in '/dev/null'.
           - 'pipe': writes the standard output in the 'subprocess.PIPE'
@@ -397,40 +576,40 @@ class Network:
         @return A 'subprocess.Popen' instance or (file object,
         subprocess.Popen) when the 'out_option' is set to 'file'.
         """
-        if isinstance(host_, str):
-            if host_ not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not found " % host_ \
-                    + "in the list of hosts."
-            index = [x.name for x in self.hosts].index(host_)
-            return self.hosts[index].LaunchSubProcess(command, out_option)
-        if isinstance(host_, host.Host):
-            if host_.name not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not " % host_.name \
-                    + "found in the list of hosts."
-            return host_.LaunchSubProcess(command, out_option)
+        return self.GetHost(host_).LaunchSubProcess(command, out_option)
+
+
+    def LaunchBatch(self, command_list, host_ = None, out_option = None,
+                    max_output = None):
+        """Launches several commands in the background over a single
+        session.
+        \param command_list The list of commands.
+        \param host_ The name of the host or a 'host.Host' instance. The
+        local host by default.
+        \param out_option None, 'pipe' or 'file' (see
+        'host.Host.LaunchBatch').
+        \param max_output The maximum number of bytes kept for each output
+        with the option 'pipe', or None for no limit.
+        @return A list of 'agent.AgentProcess' instances, or of tuples (file
+        object, 'agent.AgentProcess') when the 'out_option' is set to
+        'file'.
+        """
+        return self.GetHost(host_).LaunchBatch(command_list, out_option,
+                                               max_output)
 
 
     def LaunchWait(self, command, ltime, wait = 0.1,
-                   host_ = socket.gethostname()):
+                   host_ = None):
         """Launches a command in the background and waits for its output for a
         given time after which the process is killed.
         \param ltime The limit time.
         \param wait The waiting time.
         \param command The name of the command.
-        \param host_ The name of the host or a 'host.Host' instance.
+        \param host_ The name of the host or a 'host.Host' instance. The
+        local host by default.
         @return The output and the status of the command in a tuple.
         """
-        if isinstance(host_, str):
-            if host_ not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not found " % host_ \
-                    + "in the list of hosts."
-            index = [x.name for x in self.hosts].index(host_)
-            return self.hosts[index].LaunchWait(command, ltime, wait)
-        if isinstance(host_, host.Host):
-            if host_.name not in [x.name for x in self.hosts]:
-                raise ValueError, "The host name '%s' not " % host_.name \
-                    + "found in the list of hosts."
-            return host_.LaunchWait(command, ltime, wait)
+        return self.GetHost(host_).LaunchWait(command, ltime, wait)
 
 
     def SendMail(self, subject, fromaddr, toaddr, msg = ""):
@@ -486,65 +665,172 @@ class Network:
 # THREADING CLASS #
 ###################
 
-class ThreadHost(threading.Thread):
-    """A derived class of 'threading.Thread'.
-    It is used to declare a list of hosts with multi-threading.
+
+class ThreadPool:
+    """A pool with a bounded number of threads.
+    It applies a function to a list of arguments with multi-threading. The
+    threads are started on demand and are reused from one call to the other.
     """
-    def __init__(self, hostname, forced_ssh_config = False):
+
+
+    def __init__(self, Nthread = 32):
         """The constructor.
-        \param hostname A name of host.
-        \param forced_ssh_config Would like to use the PuppetMaster SSH
-        configuration? (True or False). See the variable 'host.__sshconfig__'.
+        \param Nthread The maximum number of threads.
         """
-        threading.Thread.__init__(self)
-        ## The host name.
-        self.hostname = hostname
-        ## PuppetMaster SSH configuration?
-        self.forced_ssh_config = forced_ssh_config
-    def run(self):
-        """Runs the thread.
-        """
-        ## The 'host' instance.
-        self.host_instance = host.Host(self.hostname, self.forced_ssh_config)
+        ## The maximum number of threads.
+        self.Nthread = Nthread
+
+        ## The queue of the tasks to be processed.
+        self.task = Queue.Queue()
+
+        ## The list of the 'ThreadWorker' instances.
+        self.worker_list = []
 
+        ## A lock on the list of workers.
+        self.lock = threading.Lock()
 
-class ThreadUptime(threading.Thread):
+
+    def Grow(self, Ntask):
+        """Starts new threads if necessary.
+        \param Ntask The number of tasks to be processed.
+        """
+        self.lock.acquire()
+        try:
+            self.worker_list = [x for x in self.worker_list if not x.retired]
+            while len(self.worker_list) < min(self.Nthread, Ntask):
+                worker = ThreadWorker(self.task)
+                self.worker_list.append(worker)
+                worker.start()
+        finally:
+            self.lock.release()
+
+
+    def Map(self, function, argument_list, timeout = None, default = None):
+        """Applies a function to a list of arguments.
+        The results are returned as soon as they are available. If a task
+        raises an exception or is not done before the time limit, its result
+        is 'default'. The thread which is stuck with a task out of time is
+        replaced with a new thread.
+        \param function The function to be called with one argument.
+        \param argument_list The list of arguments.
+        \param timeout The time limit of a task (in seconds), from the
+        beginning of its processing. No limit if set to None.
+        \param default The result of a failed task.
+        @return A generator of tuples (argument, result).
+        """
+        result = Queue.Queue()
+        for i in range(len(argument_list)):
+            self.task.put((function, i, argument_list[i], default, result))
+        self.Grow(len(argument_list))
+        # Beginning date and worker of the running tasks.
+        running = {}
+        Ndone = 0
+        while Ndone < len(argument_list):
+            wait = 60.
+            if timeout is not None and len(running) != 0:
+                deadline = min([x[0] for x in running.values()]) + timeout
+                wait = max(deadline - time.time(), 0.)
+            try:
+                kind, i, value = result.get(True, wait)
+                if kind == "begin":
+                    running[i] = value
+                elif running.has_key(i):
+                    del running[i]
+                    Ndone += 1
+                    yield argument_list[i], value
+            except Queue.Empty:
+                pass
+            # The tasks out of time.
+            if timeout is not None:
+                current_time = time.time()
+                for i in running.keys():
+                    if running[i][0] + timeout <= current_time:
+                        running[i][1].retired = True
+                        del running[i]
+                        Ndone += 1
+                        yield argument_list[i], default
+                self.Grow(len(argument_list) - Ndone)
+
+
+    def Stop(self):
+        """Stops the threads and waits for their end.
+        The threads stuck with a task out of time end with their task. The
+        pool may be used again: new threads are started on demand.
+        """
+        self.lock.acquire()
+        try:
+            worker_list = [x for x in self.worker_list if not x.retired]
+            self.worker_list = []
+        finally:
+            self.lock.release()
+        for worker in worker_list:
+            self.task.put(None)
+        for worker in worker_list:
+            worker.join()
+
+
+class ThreadMonitor(threading.Thread):
     """A derived class of 'threading.Thread'.
-    It is used to launch the Unix command 'uptime' to a list of hosts with
-    multi-threading.
+    It probes the hosts of a network periodically.
     """
-    def __init__(self, host):
+    def __init__(self, net, interval):
         """The constructor.
-        \param host A 'host.Host' instance.
+        \param net A 'Network' instance.
+        \param interval The period of time between two probes of a host (in
+        seconds).
         """
         threading.Thread.__init__(self)
-        ## The 'host' instance.
-        self.host = host
-        ## The host name.
-        self.hostname = self.host.name
+        self.setDaemon(True)
+        ## The 'Network' instance.
+        self.net = net
+        ## The period of time between two probes.
+        self.interval = interval
+        ## Set when the thread has to stop.
+        self.stop = threading.Event()
     def run(self):
         """Runs the thread.
         """
-        ## A list of floats or a string if the connection failed.
-        self.uptime = self.host.GetUptime()
+        def probe(host_):
+            return host_.Probe()
+        while not self.stop.isSet():
+            for result in self.net.pool.Map(probe, self.net.hosts,
+                                            self.net.timeout):
+                pass
+            self.stop.wait(self.interval)
+    def Stop(self):
+        """Stops the thread and waits for its end.
+        """
+        self.stop.set()
+        if self.isAlive() and threading.currentThread() is not self:
+            self.join()
 
 
-class ThreadUsedMemory(threading.Thread):
+class ThreadWorker(threading.Thread):
     """A derived class of 'threading.Thread'.
-    It is used to launch the Unix command 'free' to a list of hosts with
-    multi-threading.
+    It processes the tasks of a 'ThreadPool' instance.
     """
-    def __init__(self, host):
+    def __init__(self, task):
         """The constructor.
-        \param host A 'host.Host' instance.
+        \param task The 'Queue.Queue' instance of the tasks.
         """
         threading.Thread.__init__(self)
-        ## The 'host' instance.
-        self.host = host
-        ## The host name.
-        self.hostname = self.host.name
+        self.setDaemon(True)
+        ## The queue of the tasks.
+        self.task = task
+        ## Is the thread replaced with a new one?
+        self.retired = False
     def run(self):
         """Runs the thread.
         """
-        ## An integer or a string if the connection failed.
-        self.used_memory = self.host.GetUsedMemory()
+        while not self.retired:
+            task = self.task.get()
+            if task is None:
+                # The pool is stopped.
+                break
+            function, i, argument, default, result = task
+            result.put(("begin", i, (time.time(), self)))
+            try:
+                value = function(argument)
+            except Exception:
+                value = default
+            result.put(("end", i, value))
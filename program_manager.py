@@ -23,6 +23,9 @@ Class list:
   <li>ProgramManager</li>
   <li>Program</li>
   <li>Configuration</li>
+  <li>Replacer</li>
+  <li>Template</li>
+  <li>ResultCache</li>
  </ul>
 
 \author Vivien Mallet, Damien Garaud
@@ -30,7 +33,38 @@ Class list:
 
 import os
 
-from puppetmaster import network
+from puppetmaster import host, network, scheduler
+
+
+## The templates of configuration files already parsed, indexed by the file
+## name. See the function 'load_template'.
+__template_cache__ = {}
+
+
+###########################
+# MISCELLANEOUS FUNCTIONS #
+###########################
+
+
+def load_template(filename, key_list, Ntemplate = 64):
+    """Returns the template of a configuration file.
+    The file is parsed only once for a given list of replaced strings, unless
+    it is modified.
+    \param filename The path to the configuration file.
+    \param key_list The list of replaced strings.
+    \param Ntemplate The maximum number of templates kept in memory.
+    @return A 'Template' instance.
+    """
+    key_set = frozenset([str(x) for x in key_list])
+    stat = os.stat(filename)
+    signature = (stat.st_mtime, stat.st_size, key_set)
+    template = __template_cache__.get(filename)
+    if template is None or template[0] != signature:
+        if len(__template_cache__) >= Ntemplate:
+            __template_cache__.clear()
+        template = (signature, Template(filename, key_set))
+        __template_cache__[filename] = template
+    return template[1]
 
 
 ###################
@@ -43,308 +77,315 @@ class ProgramManager:
     """
 
 
-    def __init__(self, net = network.Network()):
+    def __init__(self, net = None):
         """Initializes the network and the logs.
         \param net The network over which the simuations should be launched.
+        If set to None, the local host is used, and the network is created on
+        first use (see 'GetNetwork').
         """
-        ## The list of programs.
+        ## The list of programs, sorted by group (see 'GetProgramList').
         self.program_list = []
 
+        ## The lists of programs indexed by group.
+        self.group_index = {}
+
+        ## The sorted list of groups.
+        self.group_list = []
+
+        ## Is 'program_list' sorted by group?
+        self.is_sorted = True
+
         ## A string.
         self.log = "-" * 78 + "\n\n"
 
         ## The list of processes.
         self.process = []
 
-        ## A 'network.Network' instance.
+        ## The standard output and error of the processes, as tuples.
+        self.output_list = []
+
+        ## The 'scheduler.EventLog' instance of the last run on the network,
+        ## or None.
+        self.event_log = None
+
+        ## The 'scheduler.EventLog' instances of all runs on the network.
+        self.event_log_list = []
+
+        ## A 'network.Network' instance, or None.
         self.net = net
 
 
     def GetLog(self):
         """Returns the log.
+        The logs of the runs on the network are rebuilt from their event logs
+        (see 'RunNetwork').
         @return Simulation logs.
         """
-        return self.log
+        text = self.log
+        for event_log in self.event_log_list:
+            text += event_log.GetText() + self.GetSummary(event_log)
+        return text
+
+
+    def GetSummary(self, event_log = None):
+        """Returns the summary of a run on the network.
+        \param event_log The 'scheduler.EventLog' instance of the run. The
+        last run by default.
+        @return A string with the command, the status, the host and the dates
+        of each program.
+        """
+        import time
+        if event_log is None:
+            event_log = self.event_log
+        if event_log is None:
+            return ""
+        end_list = [x for x in event_log.Read() if x["event"] == "end"]
+        end_list.sort(key = lambda x: x["index"])
+        text = ['-' * 78 + '\n']
+        for i in range(len(end_list)):
+            record = end_list[i]
+            # New group ?
+            if i > 0 and record["group"] != end_list[i - 1]["group"]:
+                text.append(("### GROUP " + record["group"]
+                             + " ###").center(78))
+                text.append("\n\n" + "-" * 78 + "\n\n")
+            text.append(record["command"])
+            if not record["command"].endswith("\n"):
+                text.append("\n")
+            text.append("\nStatus: " + str(record["status"]) + "\n")
+            text.append("Hostname: " + str(record["host"]) + "\n")
+            text.append("Started at " + time.ctime(record["beg_time"]) + "\n")
+            text.append("Ended at " + time.ctime(record["end_time"]) + "\n")
+            text.append("\n" + "-" * 78 + "\n\n")
+        return u"".join(text).encode("latin-1")
+
+
+    def GetNetwork(self):
+        """Returns the network.
+        The network of the local host is created if no network was set.
+        @return The 'network.Network' instance.
+        """
+        if self.net is None:
+            self.net = network.Network()
+        return self.net
 
 
-    def SetNetwork(self, net = network.Network()):
+    def SetNetwork(self, net = None):
         """Sets the network.
         \param net The network over which the simuations should be launched.
+        If set to None, the local host is used, and the network is created on
+        first use (see 'GetNetwork').
         """
         self.net = net
 
 
     def AddProgram(self, program):
         """Adds a program.
+        The program is appended to its group.
         \param program The program to be added.
         """
+        import bisect
         if isinstance(program, str):
-            self.program_list.append(Program(program))
-        else:
+            program = Program(program)
+        if not self.group_index.has_key(program.group):
+            self.group_index[program.group] = []
+            bisect.insort(self.group_list, program.group)
+        self.group_index[program.group].append(program)
+        if self.is_sorted and program.group == self.group_list[-1]:
             self.program_list.append(program)
-        def compare(prg_x, prg_y):
-            """Compares the group number between two programs.
-            """
-            if prg_x.group < prg_y.group:
-                return -1
-            elif prg_x.group > prg_y.group:
-                return 1
-            else:
-                return 0
-        self.program_list.sort(compare)
+        else:
+            self.is_sorted = False
+
+
+    def AddPrograms(self, program_list):
+        """Adds several programs.
+        \param program_list An iterable of programs.
+        """
+        for program in program_list:
+            self.AddProgram(program)
+
+
+    def GetProgramList(self):
+        """Returns the list of programs sorted by group.
+        Inside a group, the programs are in the order they were added.
+        @return The list of programs.
+        """
+        if not self.is_sorted:
+            self.program_list = []
+            for group in self.group_list:
+                self.program_list += self.group_index[group]
+            self.is_sorted = True
+        return self.program_list
 
 
     def Clear(self):
         """Clears all; primarily, the program list and the logs.
         """
         self.program_list = []
+        self.group_index = {}
+        self.group_list = []
+        self.is_sorted = True
         self.log = "-" * 78 + "\n\n"
+        self.CloseEventLog()
 
 
-    def Run(self):
+    def CloseEventLog(self):
+        """Closes the event logs, and removes the temporary ones.
+        """
+        for event_log in self.event_log_list:
+            event_log.Close()
+        self.event_log_list = []
+        self.event_log = None
+
+
+    def Run(self, Nprocess = 1):
         """Executes the set of programs on localhost.
+        The programs of a group are launched once all programs of the
+        previous group are done. Once a program failed, no other program is
+        launched and an exception is raised.
+        \param Nprocess The number of programs run at the same time. If set
+        to None, the number of processors available to PuppetMaster is used
+        (see 'host.read_processor_number'). If set to 1, the programs are run
+        in the calling thread.
         """
-        if len(self.program_list) == 0:
+        if len(self.GetProgramList()) == 0:
             raise Exception, "The program list is empty."
-        for program in self.program_list:
+        if Nprocess is None:
+            Nprocess = host.read_processor_number()
+        pool = None
+        if Nprocess != 1:
+            pool = network.ThreadPool(Nprocess)
+        failed_list = []
+        def run(program):
+            if len(failed_list) != 0:
+                return False
             print "Program name: ", program.name.split("/")[-1]
-            program.Run()
-            self.log += program.log
-            if self.log[-1] != "\n":
-                self.log += "\n"
-            self.log += "\n" + "-" * 78 + "\n\n"
+            # The pool would replace the exception with a default result.
+            try:
+                program.Run()
+            except Exception, error:
+                failed_list.append(program)
+                return error
             if program.status != 0:
-                print self.log
-                raise Exception, "Program \"" + program.basename \
-                      + "\" failed."
-
-
-    def RunNetwork(self, delay = 2., buzy_time = 10., wait_time = 10.,
-                   out_option = None):
+                failed_list.append(program)
+            return True
+        try:
+            for group in self.group_list:
+                program_list = self.group_index[group]
+                if pool is None:
+                    result_list = [(x, run(x)) for x in program_list]
+                else:
+                    result_list = pool.Map(run, program_list)
+                result = dict([(id(x[0]), x[1]) for x in result_list])
+                # The logs are written in the order of the programs.
+                for program in program_list:
+                    if result[id(program)] is not True:
+                        continue
+                    self.log += program.log
+                    if self.log[-1] != "\n":
+                        self.log += "\n"
+                    self.log += "\n" + "-" * 78 + "\n\n"
+                for program in program_list:
+                    if isinstance(result[id(program)], Exception):
+                        raise result[id(program)]
+                if len(failed_list) != 0:
+                    print self.log
+                    raise Exception, "Program \"" + failed_list[0].basename \
+                          + "\" failed."
+        finally:
+            if pool is not None:
+                pool.Stop()
+
+
+    def RunNetwork(self, delay = 0., buzy_time = 10., wait_time = 10.,
+                   out_option = None, max_output = 65536, log_file = None,
+                   retry = None, journal_file = None, resume = False,
+                   cache = None, batch = False, speculation = None):
         """Executes the set of programs on the network.
+        A program is launched as soon as a processor is free (see
+        'scheduler.Scheduler').
         \param delay The minimum period of time between the launching of two
-        programs. Unit: seconds.
+        programs. No limit if it is set to 0. Unit: seconds.
         \param buzy_time The waiting time before checking a new available
         hosts.
-        \param wait_time The waiting time before the end of a group of
-        programs.
+        \param wait_time Unused, kept for compatibility: the end of a program
+        is notified as soon as it occurs.
         \param outoption A string.
           - None: writes the standard output in '/dev/null'.
           - 'pipe': writes the standard output in the 'subprocess.PIPE'
           - 'file': writes the standard output in file such as
             '/tmp/puppet-hostname-erTfZ'.
+        \param max_output The maximum number of bytes kept for the standard
+        output and for the standard error of each program. The kept outputs
+        are in the attribute 'output_list'.
+        \param log_file The path to the file where the events are logged,
+        one JSON object per line (see 'scheduler.EventLog'). A temporary file
+        by default. The method 'GetLog' rebuilds the log from this file.
+        \param retry A 'scheduler.RetryPolicy' instance which decides
+        whether failed programs are launched again. No retry by default.
+        \param journal_file The path to a file where the launchings and the
+        ends of the programs are recorded and synced to the disk (see
+        'scheduler.Journal'), or None.
+        \param resume Is the campaign recorded in 'journal_file' resumed?
+        (True or False). The programs which ended successfully are not
+        launched again. The programs which were running when PuppetMaster
+        stopped are launched again.
+        \param cache A 'ResultCache' instance, or None. The programs whose
+        results are in the cache are not launched: their status and outputs
+        are restored.
+        \param batch If True, the programs launched at the same time on a
+        host share a single SSH session, which saves the SSH handshakes for
+        short programs (see 'host.Host.LaunchBatch').
+        \param speculation The fraction of the programs of a group which must
+        be ended before the slowest running programs of the group are copied
+        on other hosts, or None. The first copy which ends successfully is
+        kept (see 'scheduler.Scheduler.Speculate'). It requires 'batch', or
+        agents running on the hosts.
         """
-        import time
-        import copy
-        if len(self.program_list) == 0:
+        if len(self.GetProgramList()) == 0:
             raise Exception, "The program list is empty."
-        self.process = []
-        host_list = []
-        self.output_file_list = []
-        already_dead = [False for i in range(len(self.program_list))]
-        beg_time = []
-        end_time = ["" for i in range(len(self.program_list))]
-        # Index of the first program from current group.
-        i_group = 0
-        count_program = 1
-        count_host = 0
-        # List of available hosts (tuple: (hostname, Ncpu))
-        host_available = self.net.GetAvailableHosts()
-        Ncpu_list = [x[1] for x in host_available]
-        # Sum of available cpus.
-        Ncpu = sum(Ncpu_list)
-        cpu_cumsum = [sum(Ncpu_list[0:x + 1]) for x in range(len(Ncpu_list))]
         # Copies and replaces for configuration files.
-        for i in range(len(self.program_list)):
-            program = self.program_list[i]
+        for program in self.program_list:
             program.config.Proceed()
-        self.log += "Available host %s\n" % str(host_available)
-        self.log += "Cumulative sum %s\n" % str(cpu_cumsum)
-        self.log += "Ncpu %s\n" % Ncpu
+        if journal_file is not None:
+            journal = scheduler.Journal(journal_file, resume)
+        else:
+            journal = None
         # Program runs on Network.
-        for i in range(len(self.program_list)):
-            program = self.program_list[i]
-            self.log += '-' * 78 + '\n'
-            self.log += "Program index %i\n" % i
-            self.log += "Program Command '%s'\n" % program.Command()
-            self.log += "First index program Group '%i'\n" % i_group
-            if i > i_group and program.group != self.program_list[i-1].group:
-                # If any process from the previous group is still up.
-                while None in [x.poll() for x in self.process[i_group:]]:
-                    time.sleep(wait_time)
-                i_group = i
-                count_program = 1
-                count_host = 0
-                host_available = self.net.GetAvailableHosts()
-                Ncpu_list = [x[1] for x in host_available]
-                Ncpu = sum(Ncpu_list)
-                cpu_cumsum = [sum(Ncpu_list[0:x + 1]) for x \
-                              in range(len(Ncpu_list))]
-            # If all hosts are busy.
-            if count_program > Ncpu:
-                self.log += " --- Host Busy ---\n"
-                time.sleep(buzy_time)
-                host_available = self.net.BusySoWait(buzy_time)
-                count_host = 0
-                count_program = 1
-                Ncpu_list = [x[1] for x in host_available]
-                Ncpu = sum(Ncpu_list)
-                cpu_cumsum = [sum(Ncpu_list[0:x + 1]) for x \
-                              in range(len(Ncpu_list))]
-                self.log += "\tNew hosts list.\n"
-                self.log += '\t' + str(host_available) + ' \n'
-                self.log += "\tcpu_cum_sum %s\n" % str(cpu_cumsum)
-                self.log += "\tNcpu %i\n" % Ncpu
-                self.log += " --- End Host Busy ---\n"
-
-            # Changes host.
-            self.log += "Count program %i\n" % count_program
-            self.log += "Count host %i\n" % count_host
-            self.log += "Length cpu_cumsum %i\n" % len(cpu_cumsum)
-            self.log += "Index cpu cumulative sum %i\n" % cpu_cumsum[count_host]
-            if count_program > cpu_cumsum[count_host]:
-                count_host += 1
-                self.log += "Changed Host."
-                self.log += "Count host %i\n" % count_host
-            current_host = host_available[count_host][0]
-            self.log += "Current host name '%s'\n" % current_host
-
-            # Launches the subprocess.
-            print "Program: ", program.basename, \
-                " - Available host: ", current_host
-            if out_option == 'file':
-                outfile, current_subproc = \
-                    self.net.LaunchSubProcess(program.Command(),
-                                              current_host,
-                                              out_option)
-                self.output_file_list.append(outfile)
-            else:
-                current_subproc = self.net.LaunchSubProcess(program.Command(),
-                                                            current_host)
-            self.log += "Sub-program with the ID %i\n" % current_subproc.pid
-            self.process.append(current_subproc)
-            count_program += 1
-            host_list.append(current_host)
-            beg_time.append(time.asctime())
-
-            # If processus is done, writes the ended date.
-            for j in range(i):
-                if end_time[j] == "" and self.process[j].poll() != None:
-                    end_time[j] = time.asctime()
-
-            # Checks current process status.
-            i_proc = copy.copy(i_group)
-            # Loop on current running subprocess.
-            for subproc in self.process[i_group:]:
-                if subproc.poll() != None and subproc.wait() != 0:
-                    if not already_dead[i_proc]:
-                        std_message = subproc.communicate()
-                        warning_message = "\n\rWARNING: The program: \"" \
-                            + self.program_list[i_proc].Command() \
-                            + "\" does not work on the host '" \
-                            + host_list[i_proc]  + "'.\n"\
-                            + "status: " + str(subproc.wait()) \
-                            + "\n\nOutput message:" \
-                            + " \n  STDOUT: " + str(std_message[0]) \
-                            + " \n  STDERR: " + str(std_message[1])
-                        if out_option == 'file':
-                            warning_message += "\n\rSee the file '" \
-                                + self.output_file_list[i_proc].name \
-                                + "' to read the standard output."
-                            try:
-                                self.output_file_list[i_proc].close()
-                            except:
-                                pass
-                        self.log += warning_message
-                        print warning_message
-                        print "\n\rThe other sub-processus are still" \
-                            + " running...\n"
-                        already_dead[i_proc] = True
-                i_proc += 1
-            # Wainting time.
-            time.sleep(delay)
-        # End for program launching.
-
-        # Waits for the latest programs.
-        self.log += "\nWaits for the lastet programs.\n"
-        self.log += "First index program Group '%i'\n" % i_group
-        #while None in [x.returncode for x in self.process[i_group:]]:
-        count_wait = 0
-        while None in [x.poll() for x in self.process[i_group:]]:
-            time.sleep(delay)
-            count_wait += 1
-            self.log += "Clock: " + time.asctime() + "\n"
-            self.log += "Number of waiting time: " + str(count_wait) + "\n"
-            self.log += str([x.poll() for x in self.process[i_group:]]) + "\n"
-        self.log += "All sub programs are done.\n"
-
-        # Writes the ended date.
-        for j in range(len(self.program_list)):
-            if end_time[j] == "":
-                end_time[j] = time.asctime()
-
-        # Checks process status.
-        i_proc = copy.copy(i_group)
-        for subproc in self.process[i_group:]:
-            if subproc.poll() != None and subproc.wait() != 0:
-                if not already_dead[i_proc]:
-                    std_message = subproc.communicate()
-                    warning_message = "\n\rWARNING: The program: \"" \
-                        + self.program_list[i_proc].Command() \
-                        + "\" does not work on the host '" \
-                        + host_list[i_proc]  + "'.\n"\
-                        + "status: " + str(subproc.wait()) \
-                        + "\n\nOutput message:" \
-                        + " \n  STDOUT: " + str(std_message[0]) \
-                        + " \n  STDERR: " + str(std_message[1])
-                    warning_message += "\n\rSee the file '" \
-                        + self.output_file_list[i_proc].name \
-                        + "' to read the standard output."
-                    try:
-                        self.output_file_list[i_proc].close()
-                    except:
-                        pass
-                    self.log += warning_message
-                    print warning_message
-                    print "\n\rThe other sub-processus are still running...\n"
-                    already_dead[i_proc] = True
-            i_proc += 1
+        engine = scheduler.Scheduler(self.GetNetwork(), delay, buzy_time,
+                                     out_option, max_output, log_file,
+                                     retry = retry, journal = journal,
+                                     cache = cache, batch = batch,
+                                     speculation = speculation)
+        self.event_log = engine.event_log
+        self.event_log_list.append(engine.event_log)
+        try:
+            task_list = engine.Run(self.program_list)
+        finally:
+            if journal is not None:
+                journal.Close()
+        self.process = [x.process for x in task_list]
+        self.output_list = [x.GetOutput(0.) for x in task_list]
+        self.output_file_list = [x.output_file for x in task_list
+                                 if x.output_file is not None]
 
         # Tries to close all output files.
-        if out_option == 'file':
-            for outfile in self.output_file_list:
-                try:
-                    outfile.close()
-                except:
-                    pass
-
-        # Writes the log.
-        self.log += '-' * 78 + '\n'
-        i_group = 0
-        for i in range(len(self.program_list)):
-            program = self.program_list[i]
-            # New group ?
-            if i > i_group and program.group != self.program_list[i-1].group:
-                self.log += ("### GROUP " + str(program.group)
-                             + " ###").center(78)
-                self.log += "\n\n" + "-" * 78 + "\n\n"
-                i_group = i
-            self.log += program.Command()
-            if self.log[-1] != "\n":
-                self.log += "\n"
-            self.log += "\nStatus: " + str(self.process[i].poll()) + "\n"
-            self.log += "Hostname: " + str(host_list[i]) + "\n"
-            self.log += "Started at " + str(beg_time[i]) + "\n"
-            self.log += "Ended approximatively at " + str(end_time[i]) \
-                        + "\n"
-            self.log += "\n" + "-" * 78 + "\n\n"
+        for outfile in self.output_file_list:
+            try:
+                outfile.close()
+            except:
+                pass
 
 
     def RemoveTemporayFile(self):
         """Removes a few temporary files.
         Tries to remove the files in the attribute 'ouput_file_list' if the
-        option 'out_option' was set to 'file' in the method 'RunNetwork'.
+        option 'out_option' was set to 'file' in the method 'RunNetwork'. The
+        temporary event logs are removed, once their text is put in the
+        attribute 'log'.
         """
+        self.log = self.GetLog()
+        self.CloseEventLog()
         try:
             for outfile in self.output_file_list:
                 os.remove(outfile.name)
@@ -355,7 +396,7 @@ class ProgramManager:
     def Try(self):
         """Performs a dry run.
         """
-        for program_ in self.program_list:
+        for program_ in self.GetProgramList():
             program_.Try()
             self.log += program_.log
             if self.log[-1] != "\n":
@@ -376,7 +417,8 @@ class Program:
     """
 
 
-    def __init__(self, name = None, config = None, format = " %a", group = 0):
+    def __init__(self, name = None, config = None, format = " %a", group = 0,
+                 priority = 0):
         """Full initialization.
 
         \param name the program name.
@@ -384,6 +426,8 @@ class Program:
         \param format the format of arguments, where "%a" is replaced with
         the configuration files.
         \param group the group index.
+        \param priority the priority: among the programs ready to be
+        launched, those with the highest priority are launched first.
         """
         if config is not None:
             ## \brief A configuration file.
@@ -405,8 +449,21 @@ class Program:
         ## The format of arguments.
         self.format = format
 
-        ## A string.
-        self.priority = "0"
+        ## The priority (a number, or a string which holds a number).
+        self.priority = priority
+
+        ## The number of processors used by the program.
+        self.Ncpu = 1
+
+        ## The memory used by the program (kB).
+        self.memory = 0
+
+        ## The wall-clock limit of the program (in seconds), or None.
+        self.timeout = None
+
+        ## The period of time between SIGTERM and SIGKILL when the program
+        ## is out of time (in seconds).
+        self.grace = 10.
 
         ## None.
         self.output_directory = None
@@ -414,6 +471,12 @@ class Program:
         ## The group index.
         self.group = group
 
+        ## The programs which must end before this program is launched.
+        self.dependency_list = []
+
+        ## The files read by the program, besides its configuration files.
+        self.input_file_list = []
+
         ## The status of the program.
         self.status = None
 
@@ -421,12 +484,107 @@ class Program:
         self.log = None
 
 
+    def AddInputFile(self, filename):
+        """Declares a file read by the program.
+        The content of the file is part of the digest of the program (see
+        'GetDigest').
+        \param filename The path to the file.
+        """
+        self.input_file_list.append(filename)
+
+
+    def GetDigest(self):
+        """Returns the digest of the program.
+        It depends on the program name, on the format of arguments, on the
+        contents of the configuration files (once they are proceeded) and on
+        the contents of the input files. The names of the configuration
+        files, which may be random, are not taken into account.
+        @return A string of 40 hexadecimal digits.
+        """
+        import hashlib
+        digest = hashlib.sha1()
+        digest.update(self.name + "\0" + self.format + "\0")
+        for filename in self.config.file_list + self.input_file_list:
+            input_file = open(filename, 'rb')
+            data = input_file.read(65536)
+            while data:
+                digest.update(data)
+                data = input_file.read(65536)
+            input_file.close()
+            digest.update("\0")
+        return digest.hexdigest()
+
+
+    def SetRequirement(self, Ncpu = 1, memory = 0):
+        """Sets the resources used by the program.
+        The program is launched on a host only if these resources are free.
+        \param Ncpu The number of processors.
+        \param memory The memory (kB).
+        """
+        if not isinstance(Ncpu, int) or Ncpu < 1:
+            raise ValueError, "The number of processors must be " \
+                + "an integer strictly positive."
+        if memory < 0:
+            raise ValueError, "The memory must be positive."
+        self.Ncpu = Ncpu
+        self.memory = memory
+
+
+    def SetTimeout(self, timeout, grace = 10.):
+        """Sets the wall-clock limit of the program.
+        The program is launched through the command 'timeout' of the GNU
+        core utilities on its host: the program and its children receive
+        SIGTERM once out of time, and SIGKILL after the grace period if they
+        are still running. Its status is then 124 (or 137).
+        \param timeout The wall-clock limit (in seconds), or None for no
+        limit.
+        \param grace The period of time between SIGTERM and SIGKILL (in
+        seconds).
+        """
+        if timeout is not None and timeout <= 0:
+            raise ValueError, "The wall-clock limit must be strictly positive."
+        if grace < 0:
+            raise ValueError, "The grace period must be positive."
+        self.timeout = timeout
+        self.grace = grace
+
+
+    def AddDependency(self, program):
+        """Adds a program which must end before this program is launched.
+        The groups still apply: a program is launched once all programs of
+        the previous groups are done, and once its dependencies are done.
+        \param program A 'Program' instance.
+        """
+        if program is self:
+            raise ValueError, "A program cannot depend on itself."
+        self.dependency_list.append(program)
+
+
     def Run(self):
         """Executes the program.
+        The standard output and error are appended to the attribute 'log'
+        while the program runs. The status is given as by 'os.wait'.
         """
         self.config.Proceed()
-        import commands
-        self.status, self.log = commands.getstatusoutput(self.Command())
+        import subprocess
+        process = subprocess.Popen([self.Command()], shell = True,
+                                   stdout = subprocess.PIPE,
+                                   stderr = subprocess.STDOUT)
+        self.log = ""
+        while True:
+            data = os.read(process.stdout.fileno(), 65536)
+            if not data:
+                break
+            self.log += data
+        process.stdout.close()
+        status = process.wait()
+        if self.log[-1:] == "\n":
+            self.log = self.log[:-1]
+        if status < 0:
+            # Killed by a signal.
+            self.status = -status
+        else:
+            self.status = status << 8
 
 
     def Command(self):
@@ -438,6 +596,10 @@ class Program:
         format = self.format[:]
         command = "nice time " + self.name \
                   + format.replace("%a", self.config.GetArgument())
+        if self.timeout is not None:
+            # 'timeout' signals its whole process group.
+            command = "timeout -k %g %g " % (self.grace, self.timeout) \
+                + command
         return command
 
 
@@ -615,38 +777,30 @@ class Configuration:
 
     def Proceed(self):
         """Proceeds replacement in configuration files and copy them.
+        Each raw file is parsed once (see 'Template'), then every copy is
+        written in a single pass.
         """
-        import shutil
-        import fileinput
         import tempfile
         self.file_list = []
-        if self.mode == "random_path" and self.raw_file_list is not []:
+        replacement = self.config.copy()
+        if self.mode == "random_path" and self.raw_file_list != []:
             random_path = tempfile.mkdtemp(prefix = self.path)
+            replacement["%random_path%"] = random_path
         for rawfile in self.raw_file_list:
             if self.mode == "raw":
                 if os.path.dirname(rawfile) == self.path:
                     raise Exception, "Error: attempt to overwrite" \
                           + " the raw configuration file \"" + rawfile + "\"."
                 name = os.path.join(self.path, os.path.basename(rawfile))
-                shutil.copy(rawfile, name)
             elif self.mode == "random":
                 name = os.path.join(self.path, os.path.basename(rawfile))
-                name = tempfile.mkstemp(prefix = name + "-")[1]
-                shutil.copy(rawfile, name)
+                descriptor, name = tempfile.mkstemp(prefix = name + "-")
+                os.close(descriptor)
             elif self.mode == "random_path":
                 name = os.path.join(random_path, os.path.basename(rawfile))
-                shutil.copy(rawfile, name)
+            load_template(rawfile, replacement.keys()).Render(replacement,
+                                                              name)
             self.file_list.append(name)
-
-        if self.file_list != []:
-            for line in fileinput.input(self.file_list, 1):
-                new_line = line
-                for i in self.config.keys():
-                    new_line = new_line.replace(str(i), str(self.config[i]))
-                if self.mode == "random_path":
-                    new_line = new_line.replace("%random_path%", random_path)
-                print new_line,
-            fileinput.close()
         self.ready = True
 
 
@@ -685,3 +839,221 @@ class Configuration:
             return " ".join(self.file_list[:self.Narg])
         else:
             raise Exception, "Not ready."
+
+
+############
+# REPLACER #
+############
+
+
+class Replacer:
+    """This class replaces several strings in a text.
+    All strings are searched in a single pass over the text. If several
+    strings match at the same position, the longest one is replaced.
+    """
+
+
+    def __init__(self, replacement):
+        """Compiles the strings to be replaced.
+        \param replacement The map of replaced strings and the replacement
+        values.
+        """
+        import re
+        ## The map of replaced strings and the replacement values (str).
+        self.replacement = {}
+        for key, value in replacement.iteritems():
+            if len(str(key)) != 0:
+                self.replacement[str(key)] = str(value)
+        ## The regular expression which matches the replaced strings.
+        self.pattern = None
+        key_list = sorted(self.replacement.keys(), key = len, reverse = True)
+        if len(key_list) != 0:
+            self.pattern = re.compile("(" + "|".join([re.escape(x)
+                                                      for x in key_list])
+                                      + ")")
+
+
+    def Replace(self, text):
+        """Replaces the strings in a text.
+        \param text The text.
+        @return The text with the replacements.
+        """
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(lambda x: self.replacement[x.group(0)], text)
+
+
+    def Split(self, text):
+        """Splits a text into literal segments and replaced strings.
+        \param text The text.
+        @return The list of segments, where the replaced strings are at the
+        odd indices.
+        """
+        if self.pattern is None:
+            return [text]
+        return self.pattern.split(text)
+
+
+############
+# TEMPLATE #
+############
+
+
+class Template:
+    """This class holds a configuration file parsed for replacements.
+    The file is split into literal segments and the replaced strings, so that
+    it can be rendered with several sets of replacement values.
+    """
+
+
+    def __init__(self, filename, key_list):
+        """Parses a configuration file.
+        \param filename The path to the configuration file.
+        \param key_list The list of replaced strings.
+        """
+        import stat
+        config_file = open(filename, 'r')
+        text = config_file.read()
+        config_file.close()
+
+        ## The permission bits of the file.
+        self.mode = stat.S_IMODE(os.stat(filename).st_mode)
+
+        ## \brief The literal segments and the replaced strings.
+        ## \details The replaced strings are at the odd indices.
+        self.segment_list = Replacer(dict([(x, x) for x in key_list])) \
+            .Split(text)
+
+
+    def Render(self, replacement, filename):
+        """Writes the configuration file with replacement values.
+        \param replacement The map of replaced strings and the replacement
+        values.
+        \param filename The path to the written file.
+        """
+        replacement = dict([(str(x), str(y))
+                            for x, y in replacement.iteritems()])
+        segment_list = self.segment_list[:]
+        for i in range(1, len(segment_list), 2):
+            segment_list[i] = replacement.get(segment_list[i],
+                                              segment_list[i])
+        config_file = open(filename, 'w')
+        config_file.write("".join(segment_list))
+        config_file.close()
+        os.chmod(filename, self.mode)
+
+
+################
+# RESULT CACHE #
+################
+
+
+class ResultCache:
+    """Keeps the results of the programs which ended successfully.
+    The results are indexed by the digests of the programs (see
+    'Program.GetDigest'), so that a program already run with the same
+    configuration is not launched again. The cache is a directory with one
+    JSON file per result. Beyond 'Nresult' results, the least recently used
+    ones are removed.
+    """
+
+
+    def __init__(self, directory, Nresult = 1024):
+        """Opens the cache.
+        \param directory The directory of the cache. It is created if
+        necessary.
+        \param Nresult The maximum number of results kept.
+        """
+        import collections
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        ## The directory of the cache.
+        self.directory = directory
+
+        ## The maximum number of results kept.
+        self.Nresult = Nresult
+
+        # The least recently used results come first.
+        result_list = [(os.path.getmtime(os.path.join(directory, x)), x[:-5])
+                       for x in os.listdir(directory) if x.endswith(".json")]
+        result_list.sort()
+        ## The digests of the results, from the least recently used.
+        self.digest = collections.OrderedDict([(x[1], None)
+                                               for x in result_list])
+        self.Evict()
+
+
+    def GetPath(self, digest):
+        """Returns the path to the file of a result.
+        \param digest The digest of the program.
+        @return The path.
+        """
+        return os.path.join(self.directory, digest + ".json")
+
+
+    def Get(self, program, digest = None):
+        """Returns the result of a program.
+        \param program The 'Program' instance, with its configuration files
+        proceeded.
+        \param digest The digest of the program, if it is already computed
+        (see 'Program.GetDigest').
+        @return A dictionary with the keys 'status', 'host', 'beg_time',
+        'end_time', 'stdout' and 'stderr', or None if the program is not in
+        the cache.
+        """
+        import json
+        if digest is None:
+            digest = program.GetDigest()
+        if not self.digest.has_key(digest):
+            return None
+        try:
+            result_file = open(self.GetPath(digest), 'r')
+            result = json.load(result_file)
+            result_file.close()
+            os.utime(self.GetPath(digest), None)
+        except (IOError, OSError, ValueError):
+            del self.digest[digest]
+            return None
+        # Most recently used.
+        del self.digest[digest]
+        self.digest[digest] = None
+        for key in ["stdout", "stderr"]:
+            result[key] = result[key].encode("latin-1")
+        result["host"] = str(result["host"])
+        return result
+
+
+    def Put(self, program, result, digest = None):
+        """Stores the result of a program.
+        \param program The 'Program' instance.
+        \param result A dictionary as returned by 'Get'.
+        \param digest The digest of the program, if it is already computed.
+        It should be computed before the program is launched, since the
+        program may change its input files.
+        """
+        import json, tempfile
+        if digest is None:
+            digest = program.GetDigest()
+        descriptor, filename = tempfile.mkstemp(dir = self.directory,
+                                                prefix = ".puppet-")
+        result_file = os.fdopen(descriptor, 'w')
+        # The outputs of the programs may be any bytes.
+        json.dump(result, result_file, encoding = "latin-1")
+        result_file.close()
+        os.rename(filename, self.GetPath(digest))
+        if self.digest.has_key(digest):
+            del self.digest[digest]
+        self.digest[digest] = None
+        self.Evict()
+
+
+    def Evict(self):
+        """Removes the least recently used results beyond 'Nresult'.
+        """
+        while len(self.digest) > self.Nresult:
+            digest = self.digest.popitem(last = False)[0]
+            try:
+                os.remove(self.GetPath(digest))
+            except OSError:
+                pass
@@ -0,0 +1,1835 @@
+# Copyright (C) 2010 INRIA - EDF R&D
+# Authors: Damien Garaud
+#
+# This file is part of the PuppetMaster project. It provides facilities to
+# deal with computations over a Linux network.
+#
+# This script is free; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+
+"""\package scheduler
+
+Provides class 'Scheduler' designed to launch programs over the network as
+soon as a processor is free.
+
+Class list:
+ <ul>
+  <li>Barrier</li>
+  <li>EventLog</li>
+  <li>Journal</li>
+  <li>OutputBuffer</li>
+  <li>OutputMultiplexer</li>
+  <li>ReadyQueue</li>
+  <li>Reaper</li>
+  <li>RetryPolicy</li>
+  <li>Scheduler</li>
+  <li>SlotLedger</li>
+  <li>Task</li>
+ </ul>
+
+\author Damien Garaud
+"""
+
+import os
+import time
+import json
+import errno
+import fcntl
+import Queue
+import heapq
+import select
+import signal
+import threading
+import collections
+
+
+###########################
+# MISCELLANEOUS FUNCTIONS #
+###########################
+
+
+def open_wake_pipe():
+    """Opens a pipe which wakes a thread up from 'select.poll'.
+    Both ends are non-blocking and are not inherited by the launched
+    processes.
+    @return The pipe (read end, write end).
+    """
+    wake = os.pipe()
+    for descriptor in wake:
+        flag = fcntl.fcntl(descriptor, fcntl.F_GETFL)
+        fcntl.fcntl(descriptor, fcntl.F_SETFL, flag | os.O_NONBLOCK)
+        flag = fcntl.fcntl(descriptor, fcntl.F_GETFD)
+        fcntl.fcntl(descriptor, fcntl.F_SETFD, flag | fcntl.FD_CLOEXEC)
+    return wake
+
+
+def wake_up(wake):
+    """Wakes a thread up.
+    \param wake The pipe from 'open_wake_pipe'.
+    """
+    try:
+        os.write(wake[1], "w")
+    except OSError:
+        # The pipe is full: the thread will be woken up anyway.
+        pass
+
+
+def kill_tree(pid, signal_number = signal.SIGKILL):
+    """Sends a signal to a local process and to all its descendants.
+    \param pid The process ID.
+    \param signal_number The signal.
+    """
+    children = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            stat_file = open("/proc/" + name + "/stat", 'r')
+            stat = stat_file.read()
+            stat_file.close()
+        except IOError:
+            # The process ended.
+            continue
+        # The parent process ID follows the command name and the state.
+        parent = int(stat[stat.rindex(")") + 1:].split()[1])
+        children.setdefault(parent, []).append(int(name))
+    pid_list = [pid]
+    i = 0
+    while i < len(pid_list):
+        pid_list += children.get(pid_list[i], [])
+        i += 1
+    for pid in pid_list:
+        try:
+            os.kill(pid, signal_number)
+        except OSError:
+            pass
+
+
+########
+# TASK #
+########
+
+
+class Task:
+    """A program launched (or to be launched) by the scheduler.
+    """
+
+
+    def __init__(self, index, program):
+        """Initializes the task.
+        \param index The index of the program in the program list.
+        \param program A 'program_manager.Program' instance.
+        """
+        ## The index of the program.
+        self.index = index
+
+        ## The 'program_manager.Program' instance.
+        self.program = program
+
+        ## The name of the host where the program runs.
+        self.host = None
+
+        ## A 'subprocess.Popen' instance.
+        self.process = None
+
+        ## The output file when the output option is 'file'.
+        self.output_file = None
+
+        ## An 'OutputBuffer' instance when the outputs are piped.
+        self.output = None
+
+        ## The status of the program.
+        self.status = None
+
+        ## The starting date.
+        self.beg_time = None
+
+        ## The ending date.
+        self.end_time = None
+
+        ## The number of tasks and barriers which must end before the task
+        ## is launched.
+        self.Nwaiting = 0
+
+        ## The tasks and barriers which wait for the end of this task.
+        self.dependent_list = []
+
+        ## The number of launchings.
+        self.attempt = 0
+
+        ## The names of the hosts where the task should not be launched.
+        self.excluded_host = set()
+
+        ## Did the task end in a former run? See 'Journal' and
+        ## 'program_manager.ResultCache'.
+        self.resumed = False
+
+        ## The barrier of the group of the task.
+        self.barrier = None
+
+        ## The digest of the program once the task is ready, or None (see
+        ## 'program_manager.ResultCache').
+        self.digest = None
+
+        ## The other copy of the task while both run (see
+        ## 'Scheduler.Speculate'), or None.
+        self.twin = None
+
+        ## Was the task copied?
+        self.speculated = False
+
+        ## Was the task killed because its other copy ended first?
+        self.cancelled = False
+
+        ## Was the task killed because it was out of time?
+        self.expired = False
+
+
+    def GetKey(self):
+        """Returns the key of the task in a journal.
+        The key does not depend on the names of the configuration files,
+        which may be random.
+        @return A string.
+        """
+        return "%i %s%s" % (self.index, self.program.name,
+                            self.program.format)
+
+
+    def GetDeadline(self):
+        """Returns the date after which the scheduler kills the task.
+        The program is killed on its host once out of time (see
+        'program_manager.Program.SetTimeout'), so the scheduler waits for
+        twice the grace period beyond the wall-clock limit.
+        @return A date, or None if the program has no wall-clock limit or if
+        the task was already killed.
+        """
+        if self.program.timeout is None or self.expired \
+                or self.beg_time is None:
+            return None
+        return self.beg_time + self.program.timeout + 2. * self.program.grace
+
+
+    def GetOutput(self, timeout = 1.):
+        """Returns the standard output and error of the program.
+        \param timeout The maximum waiting time for the end of the outputs
+        (in seconds).
+        @return A tuple (standard output, standard error). Only the end of
+        each output is kept (see 'OutputBuffer').
+        """
+        if self.output is not None:
+            self.output.done.wait(timeout)
+            return self.output.Get("stdout"), self.output.Get("stderr")
+        if hasattr(self.process, "AddCallback"):
+            # Launched through an agent.
+            return self.process.communicate()
+        return "", ""
+
+
+###########
+# BARRIER #
+###########
+
+
+class Barrier:
+    """The end of a group of tasks.
+    The tasks of a group depend on the barrier of the previous group, which
+    ends once all its tasks ended.
+    """
+
+
+    def __init__(self, group):
+        """Initializes the barrier.
+        \param group The group.
+        """
+        ## The group.
+        self.group = group
+
+        ## The number of tasks of the group.
+        self.Ntask = 0
+
+        ## The number of tasks which did not end yet.
+        self.Nwaiting = 0
+
+        ## The tasks which wait for the end of the group.
+        self.dependent_list = []
+
+        ## The running tasks of the group which may be copied, indexed by
+        ## their IDs in the order they were launched (see
+        ## 'Scheduler.Speculate').
+        self.running = collections.OrderedDict()
+
+
+################
+# RETRY POLICY #
+################
+
+
+class RetryPolicy:
+    """Decides whether a failed program is launched again.
+    A program is launched again if its status is retryable, until it has
+    been launched 'Nattempt' times. The n-th retry waits for
+    'backoff * factor ** (n - 1)' seconds, and it may be launched on another
+    host.
+    """
+
+
+    def __init__(self, Nattempt = 1, backoff = 10., factor = 2.,
+                 exclude_host = True, status_list = None):
+        """Initializes the policy.
+        \param Nattempt The maximum number of launchings of a program. No
+        retry if it is set to 1.
+        \param backoff The waiting time before the first retry (in seconds).
+        \param factor The multiplication factor of the waiting time after
+        each retry.
+        \param exclude_host Should a failed program avoid the hosts where it
+        failed? (True or False). The hosts are used anyway if all of them
+        were excluded.
+        \param status_list The list of retryable statuses, or "all" if all
+        non-zero statuses are retryable. By default, only the status 255,
+        which is returned by SSH when the connection failed.
+        """
+        if status_list is None:
+            status_list = [255]
+        ## The maximum number of launchings.
+        self.Nattempt = Nattempt
+
+        ## The waiting time before the first retry.
+        self.backoff = backoff
+
+        ## The multiplication factor of the waiting time.
+        self.factor = factor
+
+        ## Do failed programs avoid the hosts where they failed?
+        self.exclude_host = exclude_host
+
+        ## The list of retryable statuses, or "all".
+        self.status_list = status_list
+
+
+    def IsRetryable(self, task):
+        """Checks whether a failed task should be launched again.
+        \param task The 'Task' instance.
+        @return True or False.
+        """
+        if task.attempt >= self.Nattempt:
+            return False
+        return self.status_list == "all" or task.status in self.status_list
+
+
+    def GetDelay(self, task):
+        """Returns the waiting time before a task is launched again.
+        \param task The 'Task' instance.
+        @return The waiting time (in seconds).
+        """
+        return self.backoff * self.factor ** (task.attempt - 1)
+
+
+###############
+# READY QUEUE #
+###############
+
+
+class ReadyQueue:
+    """The tasks ready to be launched, sorted by priority.
+    The priority of a waiting task increases by 'aging' every second, so that
+    the tasks with a low priority are launched eventually. Since all waiting
+    tasks age at the same rate, the order does not change over time: the
+    tasks are kept in a heap sorted by 'aging * ready date - priority'.
+    Tasks with the same priority are launched in the order they became
+    ready.
+    """
+
+
+    def __init__(self, aging = 1. / 60.):
+        """Initializes the queue.
+        \param aging The increase of the priority of a waiting task per
+        second.
+        """
+        ## The increase of the priority per second.
+        self.aging = aging
+
+        ## The heap of tuples (key, sequence number, task).
+        self.heap = []
+
+        ## The number of tasks pushed so far.
+        self.Npushed = 0
+
+
+    def __len__(self):
+        """Returns the number of waiting tasks.
+        """
+        return len(self.heap)
+
+
+    def Push(self, task):
+        """Adds a task ready to be launched.
+        \param task A 'Task' instance.
+        """
+        key = self.aging * time.time() - float(task.program.priority)
+        heapq.heappush(self.heap, (key, self.Npushed, task))
+        self.Npushed += 1
+
+
+    def Pop(self):
+        """Removes the most urgent task.
+        @return A 'Task' instance.
+        """
+        return heapq.heappop(self.heap)[2]
+
+
+    def PopFitting(self, pick, depth = 64):
+        """Removes the most urgent task which can be placed.
+        If the most urgent task cannot be placed, the next ones are tried,
+        up to 'depth' tasks. The tasks skipped keep their rank.
+        \param pick A function which returns the host of a task, or None if
+        the task cannot be placed.
+        \param depth The maximum number of tasks tried.
+        @return A tuple (task, host), or (None, None) if no task can be
+        placed.
+        """
+        skipped = []
+        result = (None, None)
+        while len(self.heap) != 0 and len(skipped) < depth:
+            entry = heapq.heappop(self.heap)
+            hostname = pick(entry[2])
+            if hostname is not None:
+                result = (entry[2], hostname)
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return result
+
+
+#############
+# EVENT LOG #
+#############
+
+
+class EventLog:
+    """Writes the events of a campaign to a file, one JSON object per line.
+    The events are written incrementally through a buffered file, so that
+    the memory does not grow with the number of programs. A readable log is
+    rebuilt from the file on demand (see 'GetText').
+    """
+
+
+    def __init__(self, filename = None, buffering = 65536):
+        """Opens the log.
+        \param filename The path to the log file. The events are appended to
+        the file if it exists, and only the appended events are read. If set
+        to None, a temporary file such as
+        '/tmp/puppet-log-erTfZ.jsonl' is created, and it is removed when the
+        log is closed.
+        \param buffering The size of the write buffer (in bytes).
+        """
+        ## Was the log file created by the instance?
+        self.temporary = filename is None
+
+        if filename is None:
+            import tempfile
+            descriptor, filename = tempfile.mkstemp(prefix = 'puppet-log-',
+                                                    suffix = '.jsonl')
+            os.close(descriptor)
+
+        ## The path to the log file.
+        self.filename = filename
+
+        ## The file object.
+        self.file = open(filename, 'a', buffering)
+
+        ## The size of the file before the first event, from which the
+        ## events are read.
+        self.offset = os.path.getsize(filename)
+
+
+    def Write(self, event, **field):
+        """Writes an event.
+        \param event The name of the event: "group", "update", "busy",
+        "launch", "end", "retry", "warning" or "done".
+        \param field The fields of the event. The date is added.
+        """
+        field["event"] = event
+        field["time"] = time.time()
+        # The outputs of the programs may be any bytes.
+        self.file.write(json.dumps(field, encoding = "latin-1") + "\n")
+
+
+    def Flush(self):
+        """Flushes the write buffer to the file.
+        """
+        if not self.file.closed:
+            self.file.flush()
+
+
+    def Close(self):
+        """Closes the log file.
+        The temporary log file is removed: the events cannot be read anymore.
+        """
+        self.file.close()
+        if self.temporary and os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+    def __del__(self):
+        """The destructor.
+        Closes the log file.
+        """
+        try:
+            self.Close()
+        except:
+            pass
+
+
+    def Read(self):
+        """Reads the events.
+        @return A generator of dictionaries.
+        """
+        self.Flush()
+        log_file = open(self.filename, 'r')
+        try:
+            log_file.seek(self.offset)
+            for line in log_file:
+                yield json.loads(line)
+        finally:
+            log_file.close()
+
+
+    def GetText(self):
+        """Rebuilds a readable log from the events.
+        @return A string.
+        """
+        text = []
+        for record in self.Read():
+            event = record["event"]
+            if event == "group":
+                text.append("Group %s: programs %i to %i\n"
+                            % (record["group"], record["first"],
+                               record["last"]))
+            elif event == "update":
+                text.append("Available hosts %s\n"
+                            % str([(str(x[0]), x[1])
+                                   for x in record["free"]]))
+            elif event == "busy":
+                text.append(" --- Host Busy ---\n")
+            elif event == "launch":
+                text.append("Program index %i on host '%s' with the ID %i\n"
+                            % (record["index"], record["host"],
+                               record["pid"] or 0))
+            elif event == "end" and record.get("resumed"):
+                text.append("Program index %i ended with status %i in a "
+                            "former run\n" % (record["index"],
+                                               record["status"]))
+            elif event == "end":
+                text.append("Program index %i ended with status %i\n"
+                            % (record["index"], record["status"]))
+            elif event == "retry":
+                text.append("Program index %i failed with status %i on host "
+                            "'%s' (attempt %i): retried in %.1f seconds\n"
+                            % (record["index"], record["status"],
+                               record["host"], record["attempt"],
+                               record["delay"]))
+            elif event == "timeout":
+                text.append("Program index %i out of time on host '%s': "
+                            "killed\n" % (record["index"], record["host"]))
+            elif event == "speculate":
+                text.append("Program index %i copied on host '%s'\n"
+                            % (record["index"], record["host"]))
+            elif event == "cancel":
+                text.append("Program index %i killed on host '%s': its "
+                            "other copy ended first\n"
+                            % (record["index"], record["host"]))
+            elif event == "warning":
+                text.append(record["message"])
+            elif event == "done":
+                text.append("All sub programs are done.\n")
+        return u"".join(text).encode("latin-1")
+
+
+###########
+# JOURNAL #
+###########
+
+
+class Journal:
+    """Records the launching and the end of the tasks in an append-only
+    file, one JSON object per line. Each record is synced to the disk, so
+    that a campaign can be resumed after a crash of PuppetMaster: the tasks
+    which ended successfully are not launched again (see
+    'Scheduler.Run').
+    """
+
+
+    def __init__(self, filename, resume = False):
+        """Opens the journal.
+        \param filename The path to the journal file.
+        \param resume Is a former campaign resumed? (True or False). If
+        False, the former records are erased.
+        """
+        ## The path to the journal file.
+        self.filename = filename
+
+        ## The successful records "end" of the former runs, indexed by the
+        ## task keys.
+        self.completed = {}
+
+        line = "\n"
+        if resume and os.path.isfile(filename):
+            journal_file = open(filename, 'r')
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may be truncated by a crash.
+                    continue
+                if record["event"] == "end" and record["status"] == 0:
+                    self.completed[record["key"]] = record
+            journal_file.close()
+            mode = 'a'
+        else:
+            mode = 'w'
+
+        ## The file object.
+        self.file = open(filename, mode)
+        if not line.endswith("\n"):
+            # Ends the truncated line.
+            self.file.write("\n")
+
+
+    def Write(self, event, task):
+        """Records an event of a task and syncs it to the disk.
+        \param event "launch" or "end".
+        \param task The 'Task' instance.
+        """
+        record = {"event": event, "key": task.GetKey(), "host": task.host,
+                  "attempt": task.attempt, "beg_time": task.beg_time,
+                  "time": time.time()}
+        if event == "end":
+            record["status"] = task.status
+            record["end_time"] = task.end_time
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+    def Resume(self, task):
+        """Restores a task which ended successfully in a former run.
+        \param task The 'Task' instance.
+        @return True if the task was restored, False otherwise.
+        """
+        record = self.completed.get(task.GetKey())
+        if record is None:
+            return False
+        task.resumed = True
+        task.status = record["status"]
+        task.host = record["host"]
+        task.attempt = record["attempt"]
+        task.beg_time = record["beg_time"]
+        task.end_time = record["end_time"]
+        return True
+
+
+    def Close(self):
+        """Closes the journal.
+        """
+        self.file.close()
+
+
+#################
+# OUTPUT BUFFER #
+#################
+
+
+class OutputBuffer:
+    """Keeps the end of the standard output and error of a program.
+    At most 'size' bytes are kept for each output: the oldest bytes are
+    dropped.
+    """
+
+
+    def __init__(self, size = 65536):
+        """Initializes the buffer.
+        \param size The maximum number of bytes kept for each output.
+        """
+        ## The maximum number of bytes kept for each output.
+        self.size = size
+
+        ## The kept chunks of each output.
+        self.chunk = {"stdout": collections.deque(),
+                      "stderr": collections.deque()}
+
+        ## The number of kept bytes of each output.
+        self.length = {"stdout": 0, "stderr": 0}
+
+        ## The number of dropped bytes of each output.
+        self.Ndropped = {"stdout": 0, "stderr": 0}
+
+        ## Set when all outputs are closed.
+        self.done = threading.Event()
+
+
+    def Append(self, stream, data):
+        """Appends data to an output.
+        \param stream "stdout" or "stderr".
+        \param data A string.
+        """
+        chunk = self.chunk[stream]
+        chunk.append(data)
+        self.length[stream] += len(data)
+        while self.length[stream] > self.size:
+            excess = self.length[stream] - self.size
+            if len(chunk[0]) <= excess:
+                excess = len(chunk.popleft())
+            else:
+                chunk[0] = chunk[0][excess:]
+            self.length[stream] -= excess
+            self.Ndropped[stream] += excess
+
+
+    def Get(self, stream):
+        """Returns the end of an output.
+        \param stream "stdout" or "stderr".
+        @return A string.
+        """
+        if self.Ndropped[stream] != 0:
+            return "[%i bytes dropped]\n" % self.Ndropped[stream] \
+                + "".join(self.chunk[stream])
+        return "".join(self.chunk[stream])
+
+
+###############
+# SLOT LEDGER #
+###############
+
+
+class SlotLedger:
+    """Keeps the account of the processors and of the memory used on each
+    host. The free resources of a host combine the programs launched by the
+    scheduler, which are known exactly, with the load due to the other
+    users, which is measured with the load averages and the used memory.
+    The programs are placed by best fit (see 'PickHost').
+    """
+
+
+    def __init__(self, net, with_memory = False):
+        """Initializes the ledger.
+        \param net A 'network.Network' instance.
+        \param with_memory Is the available memory measured? (True or
+        False). Otherwise, the memory is not taken into account.
+        """
+        ## A 'network.Network' instance.
+        self.net = net
+
+        ## Is the available memory measured?
+        self.with_memory = with_memory
+
+        ## The number of processors for each host name.
+        self.Nprocessor = dict(net.GetProcessorNumber())
+
+        ## The total memory for each host name.
+        self.total_memory = dict(net.GetTotalMemory())
+
+        ## The number of processors used by the running programs for each
+        ## host name.
+        self.running = {}
+
+        ## The memory reserved by the running programs for each host name.
+        self.reserved = {}
+
+        ## The number of free processors for each host name.
+        self.free = {}
+
+        ## The available memory for each host name.
+        self.free_memory = {}
+
+
+    def Update(self):
+        """Measures the load of the hosts and updates the free resources.
+        """
+        self.free = dict(self.net.GetAvailableHosts(self.running))
+        if self.with_memory:
+            self.free_memory = dict(self.net.GetAvailableMemory(self.reserved))
+
+
+    def GetFreeSlot(self, hostname):
+        """Returns the number of free processors of a host.
+        \param hostname The name of the host.
+        @return An integer.
+        """
+        return min(self.free.get(hostname, 0),
+                   self.Nprocessor.get(hostname, 0)
+                   - self.running.get(hostname, 0))
+
+
+    def Fit(self, hostname, Ncpu = 1, memory = 0):
+        """Returns the resources left on a host after a program is placed.
+        \param hostname The name of the host.
+        \param Ncpu The number of processors used by the program.
+        \param memory The memory used by the program (kB).
+        @return A tuple (free processors, free memory) after the placement,
+        or None if the program does not fit.
+        """
+        free = self.GetFreeSlot(hostname) - Ncpu
+        if self.with_memory:
+            free_memory = self.free_memory.get(hostname, 0) - memory
+        else:
+            free_memory = 0
+        if free < 0 or free_memory < 0:
+            return None
+        return free, free_memory
+
+
+    def CanFit(self, Ncpu = 1, memory = 0, excluded_host = ()):
+        """Checks whether a program fits on a host once it is idle.
+        \param Ncpu The number of processors used by the program.
+        \param memory The memory used by the program (kB).
+        \param excluded_host The names of the hosts which are not
+        considered.
+        @return True if a host has enough processors and memory, False
+        otherwise.
+        """
+        for hostname, Nprocessor in self.Nprocessor.iteritems():
+            if hostname in excluded_host:
+                continue
+            if Nprocessor >= Ncpu and (not self.with_memory or
+                                       self.total_memory[hostname] >= memory):
+                return True
+        return False
+
+
+    def PickHost(self, Ncpu = 1, memory = 0, excluded_host = ()):
+        """Returns the host where a program fits best.
+        The chosen host is the one with the fewest processors left after the
+        placement, and then the least memory left, so that the largest holes
+        remain for the largest programs.
+        \param Ncpu The number of processors used by the program.
+        \param memory The memory used by the program (kB).
+        \param excluded_host The names of the hosts which are not chosen.
+        @return A host name, or None if the program does not fit anywhere.
+        """
+        hostname = None
+        best = None
+        for name in self.free.iterkeys():
+            if name in excluded_host:
+                continue
+            left = self.Fit(name, Ncpu, memory)
+            if left is not None and (best is None or left < best):
+                hostname = name
+                best = left
+        return hostname
+
+
+    def Acquire(self, hostname, Ncpu = 1, memory = 0):
+        """Accounts a program launched on a host.
+        \param hostname The name of the host.
+        \param Ncpu The number of processors used by the program.
+        \param memory The memory used by the program (kB).
+        """
+        if self.Fit(hostname, Ncpu, memory) is None:
+            raise ValueError, "Not enough free resources on the host '%s'." \
+                % hostname
+        self.running[hostname] = self.running.get(hostname, 0) + Ncpu
+        self.free[hostname] -= Ncpu
+        self.reserved[hostname] = self.reserved.get(hostname, 0) + memory
+        if self.with_memory:
+            self.free_memory[hostname] -= memory
+
+
+    def Release(self, hostname, Ncpu = 1, memory = 0):
+        """Accounts a program ended on a host.
+        \param hostname The name of the host.
+        \param Ncpu The number of processors used by the program.
+        \param memory The memory used by the program (kB).
+        """
+        self.running[hostname] -= Ncpu
+        self.free[hostname] = self.free.get(hostname, 0) + Ncpu
+        self.reserved[hostname] -= memory
+        if self.with_memory:
+            self.free_memory[hostname] = self.free_memory.get(hostname, 0) \
+                + memory
+
+
+#############
+# SCHEDULER #
+#############
+
+
+class Scheduler:
+    """Launches programs over a network.
+    A program is launched as soon as a processor is free. The scheduler does
+    not poll the processes: it is woken up by a 'Reaper' instance when a
+    process ends. The free processors are given by a 'SlotLedger' instance.
+    """
+
+
+    def __init__(self, net, delay = 0., buzy_time = 10., out_option = None,
+                 max_output = 65536, log_file = None, aging = 1. / 60.,
+                 retry = None, journal = None, cache = None, batch = False,
+                 speculation = None):
+        """Initializes the scheduler.
+        \param net A 'network.Network' instance.
+        \param delay The minimum period of time between the launching of two
+        programs (in seconds). No limit if it is set to 0.
+        \param buzy_time The period of time between two measurements of the
+        load of the hosts (in seconds).
+        \param out_option A string.
+          - None: writes the standard output in '/dev/null'.
+          - 'pipe': writes the standard output in the 'subprocess.PIPE'
+          - 'file': writes the standard output in file such as
+            '/tmp/puppet-hostname-erTfZ'.
+        \param max_output The maximum number of bytes kept for the standard
+        output and for the standard error of each program. The piped outputs
+        are drained while the programs run, so that no program is blocked on
+        a full pipe.
+        \param log_file The path to the file of the event log (see
+        'EventLog'). A temporary file by default.
+        \param aging The increase of the priority of a waiting program per
+        second (see 'ReadyQueue').
+        \param retry A 'RetryPolicy' instance which decides whether failed
+        programs are launched again. No retry by default.
+        \param journal A 'Journal' instance where the launchings and the ends
+        of the programs are recorded, or None. The programs which ended
+        successfully in the former runs recorded in the journal are not
+        launched.
+        \param cache A 'program_manager.ResultCache' instance, or None. The
+        programs whose results are in the cache are not launched, and the
+        results of the programs which end successfully are stored.
+        \param batch If True, the programs are launched by batches: the
+        programs launched at the same time on a host share a single session
+        (see 'host.Host.LaunchBatch'). Then the minimum period of time 'delay'
+        applies between two sessions.
+        \param speculation The fraction of the programs of a group which must
+        be ended before the slowest running programs of the group are copied
+        on the free processors of other hosts, such as 0.9. The first copy
+        which ends successfully is kept and the other one is killed. Only the
+        programs launched through an agent or by batches are copied, since
+        they can be killed on their hosts: the speculation requires 'batch'
+        or agents running on the hosts (see 'network.Network.StartAgent'). No
+        copy if set to None.
+        """
+        if speculation is not None and not batch and not net.agent:
+            raise ValueError, "The speculation requires the programs to be " \
+                + "launched by batches or through agents."
+        ## A 'network.Network' instance.
+        self.net = net
+
+        ## The minimum period of time between two launchings.
+        self.delay = delay
+
+        ## The period of time between two load measurements.
+        self.buzy_time = buzy_time
+
+        ## The output option.
+        self.out_option = out_option
+
+        ## The maximum number of bytes kept for each output.
+        self.max_output = max_output
+
+        ## The list of tasks.
+        self.task_list = []
+
+        ## The queue of ended tasks.
+        self.event = Queue.Queue()
+
+        ## A 'Reaper' instance.
+        self.reaper = None
+
+        ## An 'OutputMultiplexer' instance.
+        self.multiplexer = None
+
+        ## The 'ReadyQueue' instance of the tasks ready to be launched.
+        self.ready = ReadyQueue(aging)
+
+        ## A 'RetryPolicy' instance.
+        if retry is None:
+            retry = RetryPolicy()
+        self.retry = retry
+
+        ## The heap of the failed tasks waiting to be launched again, as
+        ## tuples (date, index, task).
+        self.delayed = []
+
+        ## The number of tasks which ended for good.
+        self.Nended = 0
+
+        ## The set of running tasks.
+        self.running = set()
+
+        ## The heap of the deadlines of the running tasks, as tuples (date,
+        ## index, task). See 'GetNextDeadline'.
+        self.deadline = []
+
+        ## The barriers of the groups which are almost ended (see
+        ## 'Speculate').
+        self.tail = []
+
+        ## A 'SlotLedger' instance.
+        self.ledger = SlotLedger(net)
+
+        ## The date of the last launching.
+        self.last_launch = 0.
+
+        ## An 'EventLog' instance.
+        self.event_log = EventLog(log_file)
+
+        ## A 'Journal' instance, or None.
+        self.journal = journal
+
+        ## A 'program_manager.ResultCache' instance, or None.
+        self.cache = cache
+
+        ## Are the programs launched by batches?
+        self.batch = batch
+
+        ## The fraction of ended programs of a group from which the slowest
+        ## programs are copied, or None.
+        self.speculation = speculation
+
+
+    def GetLog(self):
+        """Returns the log.
+        @return The scheduling logs, rebuilt from the event log.
+        """
+        return self.event_log.GetText()
+
+
+    def Run(self, program_list):
+        """Executes a list of programs sorted by group.
+        A program is launched once all programs of the previous groups are
+        done and once its dependencies are done (see
+        'program_manager.Program.AddDependency'), whatever their status. The
+        other programs keep running meanwhile.
+        \param program_list A list of 'program_manager.Program' instances.
+        @return The list of 'Task' instances.
+        """
+        self.task_list = [Task(i, program_list[i])
+                          for i in range(len(program_list))]
+        self.ledger.with_memory = len([x for x in program_list
+                                       if x.memory > 0]) != 0
+        for program in program_list:
+            if not self.ledger.CanFit(program.Ncpu, program.memory):
+                raise ValueError, "The program \"" + program.basename \
+                    + "\" requires more processors or memory than any host."
+        self.BuildGraph()
+        self.reaper = Reaper(self.event)
+        self.reaper.CatchSignal()
+        self.reaper.start()
+        self.multiplexer = OutputMultiplexer()
+        self.multiplexer.start()
+        try:
+            self.RunGraph()
+        finally:
+            self.reaper.ReleaseSignal()
+            self.reaper.Stop()
+            self.multiplexer.Stop()
+            self.event_log.Write("done")
+            self.event_log.Flush()
+        return self.task_list
+
+
+    def BuildGraph(self):
+        """Builds the dependencies between the tasks.
+        The groups are mapped to a chain of barriers (see 'Barrier'). The
+        tasks without dependency are put in the queue of ready tasks (see
+        'ReadyQueue').
+        """
+        task_index = dict([(id(x.program), x) for x in self.task_list])
+        barrier_list = []
+        barrier = None
+        i_group = 0
+        while i_group < len(self.task_list):
+            group = self.task_list[i_group].program.group
+            previous = barrier
+            barrier = Barrier(group)
+            barrier_list.append(barrier)
+            i = i_group
+            while i < len(self.task_list) \
+                    and self.task_list[i].program.group == group:
+                task = self.task_list[i]
+                if previous is not None:
+                    task.Nwaiting += 1
+                    previous.dependent_list.append(task)
+                for program in task.program.dependency_list:
+                    if not task_index.has_key(id(program)):
+                        raise ValueError, "The program \"" \
+                            + task.program.basename + "\" depends on a " \
+                            + "program which is not in the list."
+                    task.Nwaiting += 1
+                    task_index[id(program)].dependent_list.append(task)
+                barrier.Ntask += 1
+                barrier.Nwaiting += 1
+                task.barrier = barrier
+                task.dependent_list.append(barrier)
+                i += 1
+            self.event_log.Write("group", group = str(group), first = i_group,
+                                 last = i - 1)
+            if self.speculation is not None \
+                    and self.speculation * barrier.Ntask <= 0.:
+                self.tail.append(barrier)
+            i_group = i
+        self.CheckGraph(self.task_list + barrier_list)
+        if self.journal is not None:
+            for task in self.task_list:
+                self.journal.Resume(task)
+        for task in self.task_list:
+            if task.Nwaiting != 0:
+                continue
+            if task.resumed or self.Restore(task):
+                self.End(task)
+                self.Release(task)
+            else:
+                self.ready.Push(task)
+
+
+    def CheckGraph(self, node_list):
+        """Checks that the dependencies between the tasks are not cyclic,
+        with a topological sort of the graph.
+        \param node_list The list of all tasks and barriers.
+        """
+        Nwaiting = dict([(id(x), x.Nwaiting) for x in node_list])
+        free_list = [x for x in node_list if x.Nwaiting == 0]
+        Nfree = 0
+        while len(free_list) != 0:
+            Nfree += 1
+            for dependent in free_list.pop().dependent_list:
+                Nwaiting[id(dependent)] -= 1
+                if Nwaiting[id(dependent)] == 0:
+                    free_list.append(dependent)
+        if Nfree != len(node_list):
+            Ncyclic = len([x for x in self.task_list
+                           if Nwaiting[id(x)] != 0])
+            raise ValueError, "The dependencies between the programs are " \
+                + "cyclic: %i programs could not be launched." % Ncyclic
+
+
+    def RunGraph(self):
+        """Executes the tasks as soon as their dependencies are done and
+        waits for the end of all of them.
+        """
+        self.Update()
+        while len(self.ready) != 0 or len(self.running) != 0 \
+                or len(self.delayed) != 0:
+            self.Expire()
+            # The failed tasks whose waiting time is over.
+            while len(self.delayed) != 0 \
+                    and self.delayed[0][0] <= time.time():
+                self.ready.Push(heapq.heappop(self.delayed)[2])
+            # Launches as many programs as possible.
+            batch = collections.OrderedDict()
+            while len(self.ready) != 0:
+                task, hostname = self.ready.PopFitting(self.PickHost)
+                if task is None:
+                    break
+                self.ledger.Acquire(hostname, task.program.Ncpu,
+                                    task.program.memory)
+                if self.batch:
+                    batch.setdefault(hostname, []).append(task)
+                else:
+                    self.Launch(task, hostname)
+            for hostname, task_list in batch.items():
+                self.LaunchBatch(task_list, hostname)
+            if self.speculation is not None and len(self.ready) == 0:
+                self.Speculate()
+            # Waits for a failed task to be launched again, or for a task to
+            # be out of time, at most.
+            timeout = self.buzy_time
+            date_list = []
+            deadline = self.GetNextDeadline()
+            if deadline is not None:
+                date_list.append(deadline)
+            if len(self.delayed) != 0:
+                date_list.append(self.delayed[0][0])
+            if len(date_list) != 0:
+                timeout = max(0., min(timeout, min(date_list) - time.time()))
+            if len(self.running) != 0:
+                if not self.WaitEvent(timeout) and len(self.ready) != 0:
+                    # The other users may have released processors.
+                    self.Update()
+            elif len(self.ready) != 0:
+                # All hosts are busy because of other users.
+                self.event_log.Write("busy")
+                time.sleep(self.buzy_time)
+                self.Update()
+            elif len(self.delayed) != 0:
+                time.sleep(timeout)
+                self.Update()
+
+
+    def Release(self, node):
+        """Releases the tasks which wait for a task or a barrier.
+        The tasks which ended in a former run, or whose results are in the
+        cache, are released in turn.
+        \param node A 'Task' or 'Barrier' instance, which just ended.
+        """
+        node_list = [node]
+        while len(node_list) != 0:
+            for dependent in node_list.pop().dependent_list:
+                dependent.Nwaiting -= 1
+                if isinstance(dependent, Barrier) \
+                        and self.speculation is not None:
+                    Nended = dependent.Ntask - dependent.Nwaiting
+                    threshold = self.speculation * dependent.Ntask
+                    if Nended >= threshold and Nended - 1 < threshold:
+                        # The group is almost ended.
+                        self.tail.append(dependent)
+                if dependent.Nwaiting != 0:
+                    continue
+                if isinstance(dependent, Barrier):
+                    node_list.append(dependent)
+                elif dependent.resumed or self.Restore(dependent):
+                    self.End(dependent)
+                    node_list.append(dependent)
+                else:
+                    self.ready.Push(dependent)
+
+
+    def PickHost(self, task):
+        """Returns the host where a task fits best.
+        \param task A 'Task' instance.
+        @return A host name, or None if the task does not fit anywhere.
+        """
+        excluded_host = task.excluded_host
+        if len(excluded_host) != 0 \
+                and not self.ledger.CanFit(task.program.Ncpu,
+                                           task.program.memory,
+                                           excluded_host):
+            # No other host can take the task, such as the disconnected
+            # hosts (without processor).
+            excluded_host = ()
+        return self.ledger.PickHost(task.program.Ncpu, task.program.memory,
+                                    excluded_host)
+
+
+    def Update(self):
+        """Updates the free resources of each host.
+        """
+        self.ledger.Update()
+        self.event_log.Write("update", free = self.ledger.free.items(),
+                             free_memory = self.ledger.free_memory.items())
+
+
+    def Launch(self, task, hostname):
+        """Launches a task on a host.
+        The resources of the task must be acquired in the ledger.
+        \param task A 'Task' instance.
+        \param hostname The name of the host.
+        """
+        self.WaitDelay()
+        command = task.program.Command()
+        print "Program: ", task.program.basename, \
+            " - Available host: ", hostname
+        # The process cannot be reaped before it is watched.
+        self.reaper.lock.acquire()
+        try:
+            if self.out_option == 'file':
+                task.output_file, task.process = \
+                    self.net.LaunchSubProcess(command, hostname, 'file')
+            else:
+                task.process = self.net.LaunchSubProcess(command, hostname,
+                                                         self.out_option)
+            self.last_launch = time.time()
+            self.Watch(task, hostname)
+        finally:
+            self.reaper.lock.release()
+
+
+    def LaunchBatch(self, task_list, hostname):
+        """Launches several tasks on a host over a single session.
+        The resources of the tasks must be acquired in the ledger.
+        \param task_list A list of 'Task' instances.
+        \param hostname The name of the host.
+        """
+        self.WaitDelay()
+        for task in task_list:
+            print "Program: ", task.program.basename, \
+                " - Available host: ", hostname
+        process_list = self.net.LaunchBatch([x.program.Command()
+                                             for x in task_list],
+                                            hostname, self.out_option,
+                                            self.max_output)
+        self.last_launch = time.time()
+        for task, process in zip(task_list, process_list):
+            if self.out_option == 'file':
+                task.output_file, task.process = process
+            else:
+                task.process = process
+            self.Watch(task, hostname)
+
+
+    def WaitDelay(self):
+        """Waits for the minimum period of time between two launchings.
+        """
+        if self.delay > 0.:
+            waiting = self.last_launch + self.delay - time.time()
+            if waiting > 0.:
+                time.sleep(waiting)
+
+
+    def Watch(self, task, hostname):
+        """Accounts a launched task and watches its end.
+        \param task A 'Task' instance, whose process was just launched.
+        \param hostname The name of the host.
+        """
+        task.host = hostname
+        task.status = None
+        task.beg_time = self.last_launch
+        task.expired = False
+        task.attempt += 1
+        self.running.add(task)
+        deadline = task.GetDeadline()
+        if deadline is not None:
+            heapq.heappush(self.deadline, (deadline, task.index, task))
+        if hasattr(task.process, "AddCallback") and not task.speculated:
+            task.barrier.running[id(task)] = task
+        self.event_log.Write("launch", index = task.index, host = hostname,
+                             pid = task.process.pid)
+        if self.journal is not None:
+            self.journal.Write("launch", task)
+        if hasattr(task.process, "AddCallback"):
+            # Launched through an agent.
+            task.process.max_output = self.max_output
+        else:
+            task.output = OutputBuffer(self.max_output)
+            self.multiplexer.Add(task)
+        self.reaper.Add(task)
+
+
+    def WaitEvent(self, timeout = None):
+        """Waits for the end of a running task.
+        \param timeout The maximum waiting time (in seconds). By default,
+        'buzy_time'.
+        @return True if a task ended, False otherwise.
+        """
+        if timeout is None:
+            timeout = self.buzy_time
+        try:
+            task = self.event.get(True, timeout)
+        except Queue.Empty:
+            return False
+        self.running.remove(task)
+        task.barrier.running.pop(id(task), None)
+        self.ledger.Release(task.host, task.program.Ncpu,
+                            task.program.memory)
+        if task.cancelled:
+            # Its other copy ended first.
+            if task.output_file is not None:
+                task.output_file.close()
+            return True
+        if task.twin is not None:
+            twin = task.twin
+            task.twin = twin.twin = None
+            if task.status != 0:
+                # The other copy keeps running.
+                if task.output_file is not None:
+                    task.output_file.close()
+                return True
+            twin.cancelled = True
+            self.event_log.Write("cancel", index = twin.index,
+                                 host = twin.host)
+            self.Kill(twin)
+        # The copy which ended first stands for the program.
+        self.task_list[task.index] = task
+        if task.status != 0 and self.retry.IsRetryable(task):
+            self.Retry(task)
+            return True
+        self.End(task)
+        if task.status != 0:
+            self.Warn(task)
+        self.Release(task)
+        return True
+
+
+    def GetNextDeadline(self):
+        """Returns the earliest deadline of the running tasks.
+        The deadlines of the tasks which ended, or which were launched again,
+        are discarded.
+        @return A date, or None if no running task has a deadline.
+        """
+        while len(self.deadline) != 0:
+            deadline, index, task = self.deadline[0]
+            if task in self.running and task.GetDeadline() == deadline:
+                return deadline
+            heapq.heappop(self.deadline)
+        return None
+
+
+    def Expire(self):
+        """Kills the running tasks which are out of time.
+        """
+        current_time = time.time()
+        while True:
+            deadline = self.GetNextDeadline()
+            if deadline is None or deadline > current_time:
+                break
+            task = heapq.heappop(self.deadline)[2]
+            task.expired = True
+            task.barrier.running.pop(id(task), None)
+            self.event_log.Write("timeout", index = task.index,
+                                 host = task.host)
+            print "Program: ", task.program.basename, \
+                " - Out of time on host: ", task.host
+            self.Kill(task)
+
+
+    def Speculate(self):
+        """Copies the slowest running tasks of the groups which are almost
+        ended, on the hosts where processors are free.
+        Each task is copied once, on another host. The copy shares the
+        dependent tasks of the original task (see 'WaitEvent'). Only the
+        tasks launched through an agent or by batches are copied, and the
+        copies are launched by batches, so that the copy which loses can be
+        killed on its host. Only the tasks of the groups which are almost
+        ended are considered, from the earliest launched.
+        """
+        self.tail = [x for x in self.tail if x.Nwaiting != 0]
+        task_list = []
+        for barrier in self.tail:
+            task_list += barrier.running.values()
+        for task in task_list:
+            if self.ledger.PickHost() is None:
+                # No processor is free.
+                return
+            hostname = self.ledger.PickHost(task.program.Ncpu,
+                                            task.program.memory,
+                                            task.excluded_host
+                                            | set([task.host]))
+            if hostname is None:
+                continue
+            task.barrier.running.pop(id(task), None)
+            copy = Task(task.index, task.program)
+            copy.dependent_list = task.dependent_list
+            copy.barrier = task.barrier
+            copy.digest = task.digest
+            copy.excluded_host = set(task.excluded_host)
+            copy.attempt = task.attempt - 1
+            copy.twin = task
+            task.twin = copy
+            copy.speculated = task.speculated = True
+            self.ledger.Acquire(hostname, task.program.Ncpu,
+                                task.program.memory)
+            self.event_log.Write("speculate", index = task.index,
+                                 host = hostname)
+            self.LaunchBatch([copy], hostname)
+
+
+    def Kill(self, task):
+        """Kills the process of a running task.
+        The processes launched through an agent or a batch are killed on
+        their host with their children. Otherwise, the local process and its
+        children are killed: on a remote host, the program ends with its
+        wall-clock limit, if any.
+        \param task A 'Task' instance.
+        """
+        if hasattr(task.process, "AddCallback"):
+            task.process.kill()
+        else:
+            self.reaper.Kill(task)
+
+
+    def Restore(self, task):
+        """Restores the result of a task from the cache.
+        It is called once the dependencies of the task ended, since they may
+        write its input files. The digest of the program is kept, so that
+        the result is stored with the same digest.
+        \param task A 'Task' instance.
+        @return True if the result was in the cache, False otherwise.
+        """
+        if self.cache is None:
+            return False
+        try:
+            task.digest = task.program.GetDigest()
+        except IOError:
+            # An input file is missing: the result is not cached.
+            return False
+        result = self.cache.Get(task.program, task.digest)
+        if result is None:
+            return False
+        task.resumed = True
+        task.status = result["status"]
+        task.host = result["host"]
+        task.beg_time = result["beg_time"]
+        task.end_time = result["end_time"]
+        task.output = OutputBuffer(self.max_output)
+        task.output.Append("stdout", result["stdout"])
+        task.output.Append("stderr", result["stderr"])
+        task.output.done.set()
+        return True
+
+
+    def End(self, task):
+        """Accounts a task which ended for good.
+        \param task A 'Task' instance.
+        """
+        self.Nended += 1
+        self.event_log.Write("end", index = task.index, status = task.status,
+                             host = task.host, group = str(task.program.group),
+                             command = task.program.Command(),
+                             beg_time = task.beg_time,
+                             end_time = task.end_time,
+                             resumed = task.resumed)
+        if self.journal is not None and not task.resumed:
+            self.journal.Write("end", task)
+        if self.cache is not None and not task.resumed and task.status == 0 \
+                and task.digest is not None:
+            stdout, stderr = task.GetOutput()
+            self.cache.Put(task.program,
+                           {"status": task.status, "host": task.host,
+                            "beg_time": task.beg_time,
+                            "end_time": task.end_time,
+                            "stdout": stdout, "stderr": stderr}, task.digest)
+
+
+    def Retry(self, task):
+        """Puts a failed task back in the queue after a waiting time.
+        \param task A 'Task' instance.
+        """
+        delay = self.retry.GetDelay(task)
+        self.event_log.Write("retry", index = task.index, host = task.host,
+                             status = task.status, attempt = task.attempt,
+                             delay = delay)
+        print "Program: ", task.program.basename, " - Failed on host: ", \
+            task.host, " with status ", task.status, " - Retried in ", \
+            delay, " seconds"
+        if self.retry.exclude_host:
+            task.excluded_host.add(task.host)
+        if task.output_file is not None:
+            task.output_file.close()
+            task.output_file = None
+        heapq.heappush(self.delayed, (time.time() + delay, task.index, task))
+
+
+    def Warn(self, task):
+        """Reports a program which failed.
+        \param task A 'Task' instance.
+        """
+        std_message = task.GetOutput()
+        warning_message = "\n\rWARNING: The program: \"" \
+            + task.program.Command() \
+            + "\" does not work on the host '" + task.host + "'.\n" \
+            + "status: " + str(task.status) \
+            + "\n\nOutput message:" \
+            + " \n  STDOUT: " + str(std_message[0]) \
+            + " \n  STDERR: " + str(std_message[1])
+        if task.output_file is not None:
+            warning_message += "\n\rSee the file '" \
+                + task.output_file.name \
+                + "' to read the standard output."
+            try:
+                task.output_file.close()
+            except:
+                pass
+        self.event_log.Write("warning", index = task.index, host = task.host,
+                             status = task.status, message = warning_message)
+        print warning_message
+        print "\n\rThe other sub-processus are still running...\n"
+
+
+###################
+# THREADING CLASS #
+###################
+
+
+class Reaper(threading.Thread):
+    """A derived class of 'threading.Thread'.
+    A single thread waits for the end of all tasks and notifies the
+    scheduler. The thread sleeps until the signal SIGCHLD is received (see
+    'signal.set_wakeup_fd'), and then it reaps the ended processes with
+    'os.waitpid', so that the cost does not depend on the number of running
+    processes. If the signal cannot be caught, because the scheduler does
+    not run in the main thread, the processes are reaped every 'interval'
+    seconds. The processes launched through an agent notify their ends
+    themselves.
+    While processes are watched, the other children of the process are
+    reaped too, and their statuses are lost: 'subprocess.Popen' then reports
+    the status 0.
+    """
+
+
+    def __init__(self, event, interval = 1.):
+        """The constructor.
+        \param event The 'Queue.Queue' instance where the ended tasks are
+        put.
+        \param interval The period of time between two checks of the
+        processes when SIGCHLD is not caught (in seconds).
+        """
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+
+        ## The queue of ended tasks.
+        self.event = event
+
+        ## The period of time between two checks without SIGCHLD.
+        self.interval = interval
+
+        ## The running tasks indexed by their process IDs.
+        self.process = {}
+
+        ## A lock on the running tasks. A process must be launched with the
+        ## lock held, so that it is not reaped before it is watched.
+        self.lock = threading.RLock()
+
+        ## The pipe which wakes the thread up.
+        self.wake = open_wake_pipe()
+
+        ## The former handler of SIGCHLD, or None if it is not caught.
+        self.handler = None
+
+        ## The former wake-up file descriptor of the module 'signal'.
+        self.wakeup_fd = -1
+
+        ## Is the thread stopped?
+        self.stopped = False
+
+
+    def CatchSignal(self):
+        """Catches SIGCHLD so that the thread is woken up when a process
+        ends. It must be called from the main thread.
+        @return True if SIGCHLD is caught, False otherwise.
+        """
+        try:
+            self.wakeup_fd = signal.set_wakeup_fd(self.wake[1])
+        except ValueError:
+            # Not in the main thread.
+            return False
+        # The handler does nothing: the signal module writes to the pipe.
+        # Setting SIG_IGN instead would reap the children automatically.
+        self.handler = signal.signal(signal.SIGCHLD, lambda *x: None)
+        signal.siginterrupt(signal.SIGCHLD, False)
+        return True
+
+
+    def ReleaseSignal(self):
+        """Restores the former handling of SIGCHLD.
+        """
+        if self.handler is None:
+            return
+        signal.signal(signal.SIGCHLD, self.handler)
+        signal.set_wakeup_fd(self.wakeup_fd)
+        self.handler = None
+
+
+    def Add(self, task):
+        """Watches a launched task.
+        \param task A 'Task' instance.
+        """
+        if hasattr(task.process, "AddCallback"):
+            task.process.AddCallback(lambda process: self.Notify(task))
+            return
+        self.lock.acquire()
+        try:
+            self.process[task.process.pid] = task
+        finally:
+            self.lock.release()
+        # The process may have ended before it was watched.
+        wake_up(self.wake)
+
+
+    def Kill(self, task):
+        """Kills a watched process and its children.
+        Nothing is done once the process is reaped, since its process ID may
+        be reused.
+        \param task A 'Task' instance.
+        """
+        self.lock.acquire()
+        try:
+            if self.process.get(task.process.pid) is task:
+                kill_tree(task.process.pid)
+        finally:
+            self.lock.release()
+
+
+    def Notify(self, task):
+        """Notifies the end of a task.
+        \param task A 'Task' instance.
+        """
+        task.status = task.process.wait()
+        task.end_time = time.time()
+        # The exact dates of the host, when launched through an agent.
+        if getattr(task.process, "beg_time", None) is not None:
+            task.beg_time = task.process.beg_time
+        if getattr(task.process, "end_time", None) is not None:
+            task.end_time = task.process.end_time
+        self.event.put(task)
+
+
+    def Stop(self):
+        """Stops the thread and waits for its end.
+        SIGCHLD must be released before (see 'ReleaseSignal').
+        """
+        self.stopped = True
+        wake_up(self.wake)
+        self.join()
+        for descriptor in self.wake:
+            os.close(descriptor)
+
+
+    def run(self):
+        """Runs the thread.
+        """
+        poller = select.poll()
+        poller.register(self.wake[0], select.POLLIN)
+        while not self.stopped:
+            if self.handler is None:
+                timeout = int(self.interval * 1000.)
+            else:
+                timeout = None
+            try:
+                poller.poll(timeout)
+                os.read(self.wake[0], 4096)
+            except (select.error, OSError):
+                # Interrupted by a signal, or nothing to read.
+                pass
+            for task in self.Reap():
+                self.Notify(task)
+
+
+    def Reap(self):
+        """Reaps the ended processes.
+        @return The list of the tasks whose processes ended.
+        """
+        ended = []
+        self.lock.acquire()
+        try:
+            while len(self.process) != 0:
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except OSError, error:
+                    if error.errno == errno.EINTR:
+                        continue
+                    # No child process left.
+                    break
+                if pid == 0:
+                    break
+                task = self.process.pop(pid, None)
+                if task is None:
+                    # Another child of the process.
+                    continue
+                if os.WIFSIGNALED(status):
+                    task.process.returncode = -os.WTERMSIG(status)
+                else:
+                    task.process.returncode = os.WEXITSTATUS(status)
+                ended.append(task)
+        finally:
+            self.lock.release()
+        return ended
+
+
+class OutputMultiplexer(threading.Thread):
+    """A derived class of 'threading.Thread'.
+    A single thread drains the piped outputs of all running processes into
+    their 'OutputBuffer' instances, so that no process is blocked on a full
+    pipe.
+    """
+
+
+    def __init__(self):
+        """The constructor.
+        """
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+
+        ## The watched outputs indexed by their file descriptors, as tuples
+        ## (file object, stream name, task).
+        self.stream = {}
+
+        ## The outputs to be watched.
+        self.pending = []
+
+        ## A lock on the outputs to be watched.
+        self.lock = threading.Lock()
+
+        ## The pipe which wakes the thread up.
+        self.wake = open_wake_pipe()
+
+        ## Is the thread stopped?
+        self.stopped = False
+
+        ## The maximum waiting time for the outputs once stopped.
+        self.timeout = 1.
+
+
+    def Add(self, task):
+        """Drains the piped outputs of a launched task.
+        \param task A 'Task' instance, with its 'OutputBuffer' instance.
+        """
+        stream_list = [(getattr(task.process, x), x, task)
+                       for x in ["stdout", "stderr"]
+                       if getattr(task.process, x) is not None]
+        if len(stream_list) == 0:
+            task.output.done.set()
+            return
+        self.lock.acquire()
+        try:
+            self.pending += stream_list
+        finally:
+            self.lock.release()
+        wake_up(self.wake)
+
+
+    def Stop(self):
+        """Stops the thread once the outputs are closed, or after 'timeout'
+        seconds.
+        """
+        self.stopped = True
+        wake_up(self.wake)
+        self.join()
+        for file_object, name, task in self.stream.values() + self.pending:
+            file_object.close()
+        for descriptor in self.wake:
+            os.close(descriptor)
+
+
+    def run(self):
+        """Runs the thread.
+        """
+        poller = select.poll()
+        poller.register(self.wake[0], select.POLLIN)
+        deadline = None
+        while True:
+            if self.stopped and deadline is None:
+                deadline = time.time() + self.timeout
+            if deadline is not None:
+                timeout = int((deadline - time.time()) * 1000.)
+                if timeout <= 0 or len(self.stream) + len(self.pending) == 0:
+                    break
+            else:
+                timeout = None
+            try:
+                ready = poller.poll(timeout)
+            except select.error:
+                # Interrupted by a signal.
+                continue
+            for descriptor, flag in ready:
+                if descriptor == self.wake[0]:
+                    try:
+                        os.read(descriptor, 4096)
+                    except OSError:
+                        pass
+                    self.lock.acquire()
+                    try:
+                        for stream in self.pending:
+                            self.stream[stream[0].fileno()] = stream
+                            poller.register(stream[0], select.POLLIN)
+                        self.pending = []
+                    finally:
+                        self.lock.release()
+                    continue
+                file_object, name, task = self.stream[descriptor]
+                data = os.read(descriptor, 65536)
+                if data:
+                    task.output.Append(name, data)
+                    continue
+                # End of file.
+                poller.unregister(descriptor)
+                del self.stream[descriptor]
+                file_object.close()
+                if len([x for x in self.stream.values()
+                        if x[2] is task]) == 0:
+                    task.output.done.set()
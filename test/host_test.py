@@ -14,13 +14,15 @@
 # FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
 # details.
 
+import os
 import sys
 import unittest
 
-from puppetmaster import host
+from puppetmaster import agent, host
 
-test_method_name = ['testInit', 'testUptime', 'testUsedMemory',
-                    'testLaunchCommand']
+test_method_name = ['testInit', 'testProbe', 'testUptime', 'testUsedMemory',
+                    'testLaunchCommand', 'testAgent', 'testBatch',
+                    'testProcReader']
 
 
 class HostTestCase(unittest.TestCase):
@@ -81,6 +83,22 @@ class HostTestCase(unittest.TestCase):
             if self.random_host.connection:
                 self.assertTrue(isinstance(proc_num, int))
                 self.assertTrue(proc_num > 0)
+        # No SSH master connection for the local host and the fake host.
+        self.assertTrue(self.local_host.control_path is None)
+        self.assertTrue(self.fake_host.control_path is None)
+        # Each instance has its own control socket, and the directory of a
+        # failed master connection is removed.
+        import glob, tempfile
+        pattern = os.path.join(tempfile.gettempdir(), 'puppet-ssh-*')
+        directory_list = glob.glob(pattern)
+        host.Host('fake', self.forced_ssh_config)
+        self.assertTrue(glob.glob(pattern) == directory_list)
+        if self.is_file and self.random_host.control_path is not None:
+            other_host = host.Host(self.random_host.name,
+                                   self.forced_ssh_config)
+            self.assertTrue(other_host.control_path
+                            != self.random_host.control_path)
+            other_host.CloseMaster()
         # Wrong argument.
         # A 'Host' instance takes a string, a tuple or a list.
         self.assertRaises(ValueError, host.Host, 1)
@@ -91,6 +109,26 @@ class HostTestCase(unittest.TestCase):
         self.assertRaises(ValueError, host.Host, [1,2])
         self.assertRaises(ValueError, host.Host, ['host',-6])
 
+    def testProbe(self):
+        # For the local host.
+        probe = self.local_host.Probe()
+        self.assertTrue(isinstance(probe, dict))
+        self.assertTrue(probe['processor'] == self.local_host.Nprocessor)
+        self.assertTrue(probe['total_memory'] > 0)
+        self.assertTrue(len(probe['uptime']) == 3)
+        self.assertTrue(self.local_host.uptime == probe['uptime'])
+        self.assertTrue(self.local_host.probe_time is not None)
+        # For the fake host.
+        self.assertTrue(self.fake_host.Probe() is None)
+        self.assertTrue(not self.fake_host.connection)
+        # For the random host.
+        if self.is_file:
+            probe = self.random_host.Probe()
+            if self.random_host.connection:
+                self.assertTrue(isinstance(probe, dict))
+            else:
+                self.assertTrue(probe is None)
+
     def testUptime(self):
         # Gets load averages ('uptime' Unix command).
         # For the local host.
@@ -200,5 +238,88 @@ class HostTestCase(unittest.TestCase):
                 self.assertTrue(subproc.wait() != 0)
                 self.assertTrue(wait_output[0] != 0)
 
+    def testAgent(self):
+        import time
+        # For the local host.
+        self.assertTrue(self.local_host.StartAgent(interval = 0.2))
+        try:
+            subproc = self.local_host.LaunchSubProcess(self.command, 'pipe')
+            self.assertTrue(subproc.wait() == 0)
+            self.assertTrue(subproc.communicate()[0] == 'Hello World!\n')
+            self.assertTrue(subproc.beg_time <= subproc.end_time)
+            subproc = self.local_host.LaunchSubProcess('exit 3')
+            self.assertTrue(subproc.wait() == 3)
+            # Kills a process.
+            subproc = self.local_host.LaunchSubProcess('sleep 30')
+            while subproc.pid is None:
+                time.sleep(0.05)
+            subproc.kill()
+            self.assertTrue(subproc.wait() != 0)
+            # The load samples.
+            start = time.time()
+            time.sleep(0.5)
+            self.assertTrue(self.local_host.probe_time > start)
+        finally:
+            self.local_host.StopAgent()
+        self.assertTrue(self.local_host.agent is None)
+        # The interpreter ends at once: no need to wait for the time limit.
+        start = time.time()
+        self.assertTrue(not agent.Agent(python = "false").Start(30.))
+        self.assertTrue(time.time() - start < 5.)
+
+    def testBatch(self):
+        import time
+        # For the local host.
+        subproc_list = self.local_host.LaunchBatch([self.command, 'exit 3',
+                                                    'sleep 30'], 'pipe')
+        self.assertTrue(subproc_list[0].wait() == 0)
+        self.assertTrue(subproc_list[0].communicate()[0]
+                        == 'Hello World!\n')
+        self.assertTrue(subproc_list[0].beg_time <= subproc_list[0].end_time)
+        self.assertTrue(subproc_list[1].wait() == 3)
+        # Kills a process of the batch.
+        while subproc_list[2].pid is None:
+            time.sleep(0.05)
+        subproc_list[2].kill()
+        self.assertTrue(subproc_list[2].wait() != 0)
+        # The outputs are truncated on the host.
+        subproc_list = self.local_host.LaunchBatch(
+            ['head -c 100000 /dev/zero', 'echo error >&2'], 'pipe',
+            max_output = 1000)
+        self.assertTrue(subproc_list[0].communicate()[0] == '\0' * 1000)
+        self.assertTrue(subproc_list[1].communicate()[1] == 'error\n')
+        # The discarded outputs are not sent.
+        subproc_list = self.local_host.LaunchBatch(['echo error >&2', 'true'])
+        self.assertTrue(subproc_list[0].communicate() == ('', ''))
+        # The outputs in files.
+        output_list = self.local_host.LaunchBatch(['echo 1', 'echo 2'],
+                                                  'file')
+        for i in range(2):
+            self.assertTrue(output_list[i][1].wait() == 0)
+            output_list[i][0].seek(0)
+            self.assertTrue(output_list[i][0].read() == str(i + 1) + '\n')
+            output_list[i][0].close()
+            os.remove(output_list[i][0].name)
+
+    def testProcReader(self):
+        # The affinity of the process.
+        self.assertTrue(host.parse_cpu_list("0\n") == 1)
+        self.assertTrue(host.parse_cpu_list("0-3,6,8-9") == 7)
+        # The used memory, with and without the field 'MemAvailable'.
+        meminfo = host.parse_meminfo("MemTotal:        1000 kB\n"
+                                     "MemFree:          100 kB\n"
+                                     "MemAvailable:     600 kB\n"
+                                     "Buffers:           50 kB\n"
+                                     "Cached:           200 kB\n")
+        self.assertTrue(meminfo["MemTotal"] == 1000)
+        self.assertTrue(meminfo["Cached"] == 200)
+        self.assertTrue(host.compute_used_memory(meminfo) == 400)
+        del meminfo["MemAvailable"]
+        self.assertTrue(host.compute_used_memory(meminfo) == 650)
+        # The reply of a probe, where the lines are joined.
+        meminfo = host.parse_meminfo("MemTotal: 1000 kB MemFree: 100 kB")
+        self.assertTrue(host.compute_used_memory(meminfo) == 900)
+
+
 if __name__ == '__main__':
     unittest.main()
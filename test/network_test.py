@@ -22,7 +22,8 @@ from puppetmaster import network
 
 
 test_method_name = ['testInit', 'testGetValue', 'testUsedMemory',
-                    'testAvailableHost', 'testLaunchCommand']
+                    'testAvailableHost', 'testLaunchCommand', 'testThreadPool',
+                    'testMonitor']
 
 
 class NetworkTestCase(unittest.TestCase):
@@ -48,7 +49,10 @@ class NetworkTestCase(unittest.TestCase):
         self.command = "echo 'Hello World!'"
 
     def tearDown(self):
-        pass
+        # Closes the SSH master connections.
+        if self.is_file:
+            self.net.Close()
+        self.net_local.Close()
 
     def testInit(self):
         # Checks the name and the number of cpu.
@@ -141,6 +145,9 @@ class NetworkTestCase(unittest.TestCase):
             self.assertTrue(isinstance(available_host[0], tuple))
             self.assertTrue(isinstance(available_host[0][0], str))
             self.assertTrue(isinstance(available_host[0][1], int))
+        # A host never gets more programs than its number of processors.
+        running = dict(self.net_local.GetProcessorNumber())
+        self.assertTrue(self.net_local.GetAvailableHosts(running) == [])
 
         # For a list of hosts.
         if self.is_file:
@@ -172,6 +179,11 @@ class NetworkTestCase(unittest.TestCase):
         self.assertTrue(popen4_instance.wait() == 0)
         self.assertTrue(subproc.wait() == 0)
         self.assertTrue(wait_return[0] == 0)
+        # The host must belong to the network.
+        local_host = self.net_local.GetHost(socket.gethostname())
+        self.assertTrue(local_host is self.net_local.hosts[0])
+        self.assertRaises(ValueError, self.net_local.LaunchFG, self.command,
+                          'fake')
 
         # For a random host.
         if self.is_file:
@@ -204,5 +216,40 @@ class NetworkTestCase(unittest.TestCase):
                 self.assertTrue(subproc.wait() != 0)
                 self.assertTrue(wait_return[0] != 0)
 
+    def testThreadPool(self):
+        import time
+        pool = network.ThreadPool(2)
+        # The results come back as soon as they are available.
+        result = list(pool.Map(time.sleep, [0.5, 0.]))
+        self.assertTrue(result == [(0., None), (0.5, None)])
+        # A task out of time returns the default value.
+        result = dict(pool.Map(lambda x: time.sleep(x) or x, [5., 0., 0.],
+                               timeout = 0.5, default = 'off'))
+        self.assertTrue(result == {5.: 'off', 0.: 0.})
+        # The stuck thread is replaced.
+        self.assertTrue(len(pool.worker_list) <= 2)
+        result = list(pool.Map(lambda x: x + 1, range(10)))
+        self.assertTrue(sorted([x[1] for x in result]) == range(1, 11))
+        # The threads end once the pool is stopped.
+        worker_list = pool.worker_list
+        pool.Stop()
+        self.assertTrue(len([x for x in worker_list if x.isAlive()]) == 0)
+        self.assertTrue(list(pool.Map(abs, [-1])) == [(-1, 1)])
+        pool.Stop()
+
+    def testMonitor(self):
+        import time
+        self.net_local.StartMonitor(0.1)
+        time.sleep(0.3)
+        # The snapshot is recent.
+        snapshot = self.net_local.GetSnapshot()
+        self.assertTrue(len(snapshot) == 1)
+        self.assertTrue(snapshot[0][3] < 1.)
+        for available in self.net_local.GetAvailableHosts(with_age = True):
+            self.assertTrue(len(available) == 3)
+            self.assertTrue(available[2] < 1.)
+        self.net_local.StopMonitor()
+        self.assertTrue(self.net_local.monitor is None)
+
 if __name__ == '__main__':
     unittest.main()
@@ -28,7 +28,8 @@ from puppetmaster import program_manager
 class ConfigurationTestCase(unittest.TestCase):
 
     # List of all testing methods.
-    _method_name_ = ['testAccessMethods', 'testProcessingMethods']
+    _method_name_ = ['testAccessMethods', 'testProcessingMethods',
+                     'testReplacer', 'testTemplate']
     # Default path to configuration file.
     _config_file_ = '../example/example.cfg'
 
@@ -82,6 +83,42 @@ class ConfigurationTestCase(unittest.TestCase):
         # Removes the copy of the configuration file.
         os.remove(self.config.file_list[-1])
 
+    def testReplacer(self):
+        text = "%a% %ab% %b%\n%a%%b%"
+        replacement = {'%a%': 'A', '%b%': '%a%', '%ab%': 'AB'}
+        replacer = program_manager.Replacer(replacement)
+        # The replacement values are not replaced again.
+        self.assertTrue(replacer.Replace(text) == "A AB %a%\nA%a%")
+        # The longest string wins.
+        replacer = program_manager.Replacer({'%a': 'x', '%a%': 'y'})
+        self.assertTrue(replacer.Replace("%a% %a") == "y x")
+        # Same result as successive replacements without collision.
+        replacement = {'%date%': 'today', '%username%': 'user'}
+        text = open(self.config_file).read()
+        expected = text
+        for key, value in replacement.items():
+            expected = expected.replace(key, value)
+        replacer = program_manager.Replacer(replacement)
+        self.assertTrue(replacer.Replace(text) == expected)
+
+    def testTemplate(self):
+        import tempfile
+        key_list = ['%date%', '%username%']
+        template = program_manager.load_template(self.config_file, key_list)
+        # The file is parsed once.
+        self.assertTrue(template is
+                        program_manager.load_template(self.config_file,
+                                                      key_list))
+        text = open(self.config_file).read()
+        for username in ['alice', 'bob']:
+            replacement = {'%date%': 'today', '%username%': username}
+            descriptor, filename = tempfile.mkstemp()
+            os.close(descriptor)
+            template.Render(replacement, filename)
+            expected = program_manager.Replacer(replacement).Replace(text)
+            self.assertTrue(open(filename).read() == expected)
+            os.remove(filename)
+
 
 #################
 # Class Program #
@@ -104,9 +141,20 @@ class ProgramTestCase(unittest.TestCase):
         self.assertTrue(isinstance(command_name, str))
 
     def testProcessingMethods(self):
+        import threading, time
         self.assertTrue(self.program.IsReady())
         self.program.Try()
         self.program.Run()
+        # The output is read while the program runs.
+        program = program_manager.Program('/bin/sh', format = " -c 'echo "
+                                          + "one; sleep 1; exit 2'")
+        thread = threading.Thread(target = program.Run)
+        thread.start()
+        time.sleep(0.5)
+        self.assertTrue(program.log == "one\n")
+        thread.join()
+        self.assertTrue(program.log == "one")
+        self.assertTrue(program.status == 2 << 8)
 
 
 ########################
@@ -116,7 +164,8 @@ class ProgramTestCase(unittest.TestCase):
 class ProgramManagerTestCase(unittest.TestCase):
 
     # List of all testing methods.
-    _method_name_ = ['testInit', 'testAccessMethods',
+    _method_name_ = ['testInit', 'testAccessMethods', 'testAddPrograms',
+                     'testResultCache', 'testRunParallel', 'testEventLog',
                      'testProcessingMethods']
 
     def __init__(self, methodName='runTest', host_file = None,
@@ -152,6 +201,8 @@ class ProgramManagerTestCase(unittest.TestCase):
 
     def testInit(self):
         ensemble_program = program_manager.ProgramManager()
+        # The network is created on first use.
+        self.assertTrue(ensemble_program.net is None)
         # Raises an exception if the program list is empty.
         self.assertRaises(Exception, ensemble_program.Run)
         self.assertRaises(Exception, ensemble_program.RunNetwork)
@@ -160,6 +211,116 @@ class ProgramManagerTestCase(unittest.TestCase):
         log = self.program_manager.GetLog()
         self.assertTrue(isinstance(log, str))
 
+    def testAddPrograms(self):
+        ensemble_program = program_manager.ProgramManager()
+        group_list = [2, 0, 1, 0, 2]
+        ensemble_program.AddPrograms(program_manager.Program('/bin/ls',
+                                                             group = x)
+                                     for x in group_list)
+        ensemble_program.AddProgram('/bin/pwd')
+        program_list = ensemble_program.GetProgramList()
+        self.assertTrue([x.group for x in program_list]
+                        == [0, 0, 0, 1, 2, 2])
+        # The order is kept inside a group.
+        self.assertTrue(program_list[2].name == '/bin/pwd')
+
+    def testResultCache(self):
+        import shutil, tempfile
+        directory = tempfile.mkdtemp(prefix = 'puppet-test-')
+        cache = program_manager.ResultCache(directory, Nresult = 2)
+        ensemble_program = program_manager.ProgramManager()
+        ensemble_program.AddProgram(program_manager.Program('/bin/echo',
+                                                            format = ' hello'))
+        ensemble_program.RunNetwork(out_option = 'pipe', cache = cache)
+        self.assertTrue(ensemble_program.process[0] is not None)
+        # The second run is not launched.
+        ensemble_program.RunNetwork(out_option = 'pipe', cache = cache)
+        self.assertTrue(ensemble_program.process[0] is None)
+        self.assertTrue(ensemble_program.output_list[0][0] == 'hello\n')
+        # The least recently used results are removed.
+        for word in [' one', ' two']:
+            program = program_manager.Program('/bin/echo', format = word)
+            cache.Put(program, {"status": 0, "host": "keats",
+                                "beg_time": 0., "end_time": 1.,
+                                "stdout": "", "stderr": ""})
+        self.assertTrue(len(os.listdir(directory)) == 2)
+        self.assertTrue(cache.Get(program)["host"] == "keats")
+        # The input file is written by a dependency: the digest is computed
+        # once the dependency ended.
+        input_file = directory + '-input'
+        for word in ['one', 'two']:
+            ensemble_program = program_manager.ProgramManager()
+            producer = program_manager.Program('/bin/sh', format = " -c 'echo "
+                                               + word + " > " + input_file
+                                               + "'")
+            consumer = program_manager.Program('/bin/cat',
+                                               format = ' ' + input_file)
+            consumer.AddInputFile(input_file)
+            consumer.AddDependency(producer)
+            ensemble_program.AddPrograms([producer, consumer])
+            ensemble_program.RunNetwork(out_option = 'pipe', cache = cache)
+            self.assertTrue(ensemble_program.process[1] is not None)
+            self.assertTrue(ensemble_program.output_list[1][0]
+                            == word + '\n')
+        os.remove(input_file)
+        shutil.rmtree(directory)
+
+    def testRunParallel(self):
+        ensemble_program = program_manager.ProgramManager()
+        for name, group in [('/bin/true', 0), ('/bin/false', 0),
+                            ('/bin/pwd', 1)]:
+            ensemble_program.AddProgram(program_manager.Program(name,
+                                                                group = group))
+        self.assertRaises(Exception, ensemble_program.Run, None)
+        program_list = ensemble_program.GetProgramList()
+        self.assertTrue(program_list[0].status == 0)
+        self.assertTrue(program_list[1].status != 0)
+        # The next group is not launched after a failure.
+        self.assertTrue(program_list[2].status is None)
+        # The configuration of a program fails: the raw configuration file
+        # would be overwritten.
+        config_file = os.path.abspath(ConfigurationTestCase._config_file_)
+        ensemble_program = program_manager.ProgramManager()
+        program = program_manager.Program('/bin/true', group = 0)
+        program.SetConfiguration(config_file, mode = 'raw',
+                                 path = os.path.dirname(config_file))
+        ensemble_program.AddProgram(program)
+        ensemble_program.AddProgram(program_manager.Program('/bin/true',
+                                                            group = 1))
+        import threading
+        Nthread = threading.activeCount()
+        self.assertRaises(Exception, ensemble_program.Run, 2)
+        self.assertTrue(ensemble_program.GetProgramList()[1].status is None)
+        # The threads are stopped.
+        self.assertTrue(threading.activeCount() == Nthread)
+
+    def testEventLog(self):
+        ensemble_program = program_manager.ProgramManager()
+        ensemble_program.AddProgram('/bin/true')
+        ensemble_program.RunNetwork()
+        ensemble_program.RunNetwork()
+        # The log of each run is rebuilt from its own file.
+        self.assertTrue(ensemble_program.log == "-" * 78 + "\n\n")
+        self.assertTrue(ensemble_program.GetLog().count("All sub programs")
+                        == 2)
+        filename_list = [x.filename
+                         for x in ensemble_program.event_log_list]
+        ensemble_program.Clear()
+        for filename in filename_list:
+            self.assertTrue(not os.path.exists(filename))
+        # The events of the former runs in a log file are not read again.
+        import tempfile
+        descriptor, log_file = tempfile.mkstemp(prefix = 'puppet-test-')
+        os.close(descriptor)
+        for i in range(2):
+            ensemble_program.AddProgram('/bin/true')
+            ensemble_program.RunNetwork(log_file = log_file)
+            self.assertTrue(len(ensemble_program.GetSummary()
+                                .split("Status:")) == 2)
+            ensemble_program.Clear()
+        self.assertTrue(len(open(log_file).readlines()) > 2)
+        os.remove(log_file)
+
     def testProcessingMethods(self):
         self.program_manager.Try()
         self.program_manager.Run()
@@ -0,0 +1,419 @@
+# Copyright (C) 2010 INRIA - EDF R&D
+# Author: Damien Garaud
+#
+# This file is part of the PuppetMaster project. It checks the module
+# 'scheduler'.
+#
+# This script is free; you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+
+import os
+import time
+import socket
+import unittest
+
+from puppetmaster import network, program_manager, scheduler
+
+
+test_method_name = ['testRun', 'testGroup', 'testOutput', 'testEventLog',
+                    'testDependency', 'testPriority', 'testRequirement',
+                    'testRetry', 'testJournal', 'testBatch', 'testTimeout',
+                    'testAgentTime', 'testReaper', 'testSpeculation']
+
+
+def find_process(command):
+    """Checks whether a local process runs a command.
+    \param command The command line, such as 'sleep 30'.
+    @return True if a process runs the command, False otherwise.
+    """
+    for name in os.listdir('/proc'):
+        try:
+            cmdline_file = open('/proc/' + name + '/cmdline', 'r')
+            cmdline = cmdline_file.read().replace('\0', ' ').strip()
+            cmdline_file.close()
+        except IOError:
+            continue
+        if cmdline == command:
+            return True
+    return False
+
+
+class TwinNetwork(network.Network):
+    """The local host seen as two hosts with one processor each, the second
+    one being called 'twin'.
+    """
+
+    def __init__(self):
+        network.Network.__init__(self)
+        self.host_name_list = [socket.gethostname(), 'twin']
+
+    def GetProcessorNumber(self):
+        return [(x, 1) for x in self.host_name_list]
+
+    def GetTotalMemory(self):
+        return [(x, 0) for x in self.host_name_list]
+
+    def GetAvailableHosts(self, running = None, with_age = False):
+        running = running or {}
+        return [(x, 1) for x in self.host_name_list
+                if running.get(x, 0) == 0]
+
+    def LaunchSubProcess(self, command, host_ = None, out_option = None):
+        return network.Network.LaunchSubProcess(self, command, None,
+                                                out_option)
+
+    def LaunchBatch(self, command_list, host_ = None, out_option = None,
+                    max_output = None):
+        return network.Network.LaunchBatch(self, command_list, None,
+                                           out_option, max_output)
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def __init__(self, methodName='runTest', host_file = None,
+                 forced_ssh_config = False):
+        unittest.TestCase.__init__(self, methodName)
+        self.host_file = host_file
+        self.forced_ssh_config = forced_ssh_config
+        # If there is file.
+        if self.host_file == None:
+            self.is_file = False
+        else:
+            self.is_file = True
+
+    def setUp(self):
+        if self.is_file:
+            self.net = network.Network(self.host_file, self.forced_ssh_config)
+        else:
+            self.net = network.Network()
+
+    def tearDown(self):
+        pass
+
+    def testRun(self):
+        program_list = [program_manager.Program('/bin/true')
+                        for i in range(4)]
+        program_list.append(program_manager.Program('/bin/false'))
+        engine = scheduler.Scheduler(self.net)
+        start = time.time()
+        task_list = engine.Run(program_list)
+        # No delay between two launchings.
+        self.assertTrue(time.time() - start < 5.)
+        self.assertTrue(len(task_list) == 5)
+        for task in task_list[:-1]:
+            self.assertTrue(task.status == 0)
+            self.assertTrue(task.host in self.net.GetHostNames())
+            self.assertTrue(task.beg_time <= task.end_time)
+        self.assertTrue(task_list[-1].status != 0)
+        self.assertTrue(isinstance(engine.GetLog(), str))
+
+    def testGroup(self):
+        # The second group starts once the first group is done.
+        program_list = [program_manager.Program('/bin/sleep', format = ' 1',
+                                                group = 0),
+                        program_manager.Program('/bin/true', group = 1)]
+        engine = scheduler.Scheduler(self.net)
+        task_list = engine.Run(program_list)
+        self.assertTrue(task_list[0].end_time <= task_list[1].beg_time)
+
+    def testOutput(self):
+        # The outputs exceed the pipe buffers, and only their ends are kept.
+        program = program_manager.Program('/usr/bin/head',
+                                          format = ' -c 1000000 /dev/zero')
+        engine = scheduler.Scheduler(self.net, out_option = 'pipe',
+                                     max_output = 1000)
+        task = engine.Run([program])[0]
+        self.assertTrue(task.status == 0)
+        stdout = task.GetOutput()[0]
+        self.assertTrue(stdout.endswith("\0" * 1000))
+        self.assertTrue(task.output.Ndropped["stdout"] == 999000)
+
+    def testEventLog(self):
+        import os, tempfile
+        log_file = tempfile.mkstemp(prefix = 'puppet-test-')
+        os.close(log_file[0])
+        program_list = [program_manager.Program('/bin/true'),
+                        program_manager.Program('/bin/sh',
+                                                format = " -c 'printf "
+                                                "\\\\377; exit 2'")]
+        engine = scheduler.Scheduler(self.net, out_option = 'pipe',
+                                     log_file = log_file[1])
+        engine.Run(program_list)
+        event_list = [x["event"] for x in engine.event_log.Read()]
+        self.assertTrue(event_list.count("launch") == 2)
+        self.assertTrue(event_list.count("end") == 2)
+        self.assertTrue(event_list.count("warning") == 1)
+        self.assertTrue(event_list[-1] == "done")
+        log = engine.GetLog()
+        self.assertTrue(isinstance(log, str))
+        self.assertTrue("ended with status 2" in log)
+        # The outputs are kept as they are.
+        self.assertTrue("\xff" in log)
+        os.remove(log_file[1])
+
+    def testDependency(self):
+        # A program waits for its dependencies only.
+        sleep = program_manager.Program('/bin/sleep', format = ' 1')
+        dependent = program_manager.Program('/bin/true')
+        dependent.AddDependency(sleep)
+        independent = program_manager.Program('/bin/true')
+        engine = scheduler.Scheduler(self.net)
+        task_list = engine.Run([sleep, dependent, independent])
+        self.assertTrue(task_list[0].end_time <= task_list[1].beg_time)
+        # The independent program does not wait for the dependent one.
+        self.assertTrue(task_list[2].beg_time <= task_list[1].beg_time)
+        # Cyclic dependencies.
+        first = program_manager.Program('/bin/true')
+        second = program_manager.Program('/bin/true')
+        first.AddDependency(second)
+        second.AddDependency(first)
+        independent = program_manager.Program('/bin/true')
+        engine = scheduler.Scheduler(self.net)
+        self.assertRaises(ValueError, engine.Run, [independent, first, second])
+        # The cycle is detected before any launching.
+        self.assertTrue(engine.task_list[0].process is None)
+
+    def testPriority(self):
+        queue = scheduler.ReadyQueue(aging = 0.)
+        for priority in [0, "5", 1, 5]:
+            program = program_manager.Program('/bin/true',
+                                              priority = priority)
+            queue.Push(scheduler.Task(len(queue), program))
+        # Highest priority first, then in the order they became ready.
+        self.assertTrue([queue.Pop().index for i in range(4)]
+                        == [1, 3, 2, 0])
+        # A low priority task which waited long enough goes first.
+        queue = scheduler.ReadyQueue(aging = 1000.)
+        queue.Push(scheduler.Task(0, program_manager.Program('/bin/true')))
+        time.sleep(0.1)
+        queue.Push(scheduler.Task(1, program_manager.Program('/bin/true',
+                                                             priority = 10)))
+        self.assertTrue(queue.Pop().index == 0)
+
+    def testRequirement(self):
+        ledger = scheduler.SlotLedger(self.net, with_memory = True)
+        ledger.Nprocessor = {'keats': 4, 'whitman': 2}
+        ledger.total_memory = {'keats': 8000, 'whitman': 16000}
+        ledger.free = {'keats': 4, 'whitman': 2}
+        ledger.free_memory = {'keats': 8000, 'whitman': 16000}
+        # Best fit.
+        self.assertTrue(ledger.PickHost(2) == 'whitman')
+        self.assertTrue(ledger.PickHost(3) == 'keats')
+        self.assertTrue(ledger.PickHost(2, 10000) == 'whitman')
+        self.assertTrue(ledger.PickHost(3, 10000) is None)
+        ledger.Acquire('whitman', 1, 10000)
+        self.assertTrue(ledger.PickHost(1, 8000) == 'keats')
+        ledger.Release('whitman', 1, 10000)
+        self.assertTrue(ledger.PickHost(1, 8000) == 'whitman')
+        self.assertTrue(ledger.CanFit(4, 8000))
+        self.assertTrue(not ledger.CanFit(4, 9000))
+        # A program which never fits is not launched.
+        program = program_manager.Program('/bin/true')
+        program.SetRequirement(Ncpu = 1000)
+        engine = scheduler.Scheduler(self.net)
+        self.assertRaises(ValueError, engine.Run, [program])
+
+    def testRetry(self):
+        import os, tempfile
+        descriptor, marker = tempfile.mkstemp(prefix = 'puppet-test-')
+        os.close(descriptor)
+        os.remove(marker)
+        # Fails once with the status 3.
+        flaky = program_manager.Program('/bin/sh', format = " -c 'test -e "
+                                        + marker + " || { touch " + marker
+                                        + "; exit 3; }'")
+        failing = program_manager.Program('/bin/sh', format = " -c 'exit 4'")
+        policy = scheduler.RetryPolicy(Nattempt = 3, backoff = 0.2,
+                                       status_list = [3])
+        engine = scheduler.Scheduler(self.net, retry = policy)
+        task_list = engine.Run([flaky, failing])
+        os.remove(marker)
+        self.assertTrue(task_list[0].status == 0)
+        self.assertTrue(task_list[0].attempt == 2)
+        # The status 4 is not retryable.
+        self.assertTrue(task_list[1].status == 4)
+        self.assertTrue(task_list[1].attempt == 1)
+        event_list = [x["event"] for x in engine.event_log.Read()]
+        self.assertTrue(event_list.count("retry") == 1)
+        # The default statuses are not shared between the policies.
+        policy = scheduler.RetryPolicy()
+        policy.status_list.append(4)
+        self.assertTrue(scheduler.RetryPolicy().status_list == [255])
+        task_list[1].attempt = 1
+        self.assertTrue(scheduler.RetryPolicy(2, status_list = "all")
+                        .IsRetryable(task_list[1]))
+        self.assertTrue(event_list.count("end") == 2)
+        # The only other host is disconnected: the task is launched again on
+        # the host where it failed.
+        import threading
+        from puppetmaster import host
+        net = network.Network([host.Host(), host.Host('no-such-host')])
+        policy = scheduler.RetryPolicy(Nattempt = 2, backoff = 0.,
+                                       status_list = [3])
+        engine = scheduler.Scheduler(net, retry = policy)
+        failing = program_manager.Program('/bin/sh', format = " -c 'exit 3'")
+        runner = threading.Thread(target = engine.Run, args = ([failing],))
+        runner.setDaemon(True)
+        runner.start()
+        runner.join(30.)
+        self.assertTrue(not runner.isAlive())
+        self.assertTrue(engine.task_list[0].attempt == 2)
+        self.assertTrue(engine.task_list[0].status == 3)
+
+    def testJournal(self):
+        import os, tempfile
+        descriptor, journal_file = tempfile.mkstemp(prefix = 'puppet-test-')
+        os.close(descriptor)
+        program_list = [program_manager.Program('/bin/true'),
+                        program_manager.Program('/bin/false'),
+                        program_manager.Program('/bin/true', group = 1)]
+        journal = scheduler.Journal(journal_file)
+        scheduler.Scheduler(self.net, journal = journal).Run(program_list)
+        journal.Close()
+        # A record truncated by a crash.
+        journal_stream = open(journal_file, 'a')
+        journal_stream.write('{"event": "end", "key"')
+        journal_stream.close()
+        # Only the failed program is launched again.
+        journal = scheduler.Journal(journal_file, resume = True)
+        task_list = scheduler.Scheduler(self.net,
+                                        journal = journal).Run(program_list)
+        journal.Close()
+        # Only the truncated record is lost.
+        journal_stream = open(journal_file, 'r')
+        line_list = journal_stream.readlines()
+        journal_stream.close()
+        os.remove(journal_file)
+        self.assertTrue(line_list[-3] == '{"event": "end", "key"\n')
+        self.assertTrue([x.resumed for x in task_list] == [True, False, True])
+        self.assertTrue(task_list[0].process is None)
+        self.assertTrue(task_list[0].status == 0)
+        self.assertTrue(task_list[1].status != 0)
+
+    def testBatch(self):
+        program_list = [program_manager.Program('/bin/echo',
+                                                format = ' %i' % i)
+                        for i in range(6)]
+        program_list.append(program_manager.Program('/bin/false'))
+        engine = scheduler.Scheduler(self.net, out_option = 'pipe',
+                                     batch = True)
+        task_list = engine.Run(program_list)
+        # The statuses and the outputs are reported for each program.
+        for i in range(6):
+            self.assertTrue(task_list[i].status == 0)
+            self.assertTrue(task_list[i].GetOutput()[0] == '%i\n' % i)
+        self.assertTrue(task_list[-1].status != 0)
+
+    def testTimeout(self):
+        program = program_manager.Program('/bin/sleep', format = ' 30')
+        self.assertRaises(ValueError, program.SetTimeout, 0.)
+        program.SetTimeout(0.5, grace = 0.5)
+        engine = scheduler.Scheduler(self.net)
+        start = time.time()
+        task = engine.Run([program])[0]
+        # The program was killed on its host.
+        self.assertTrue(time.time() - start < 5.)
+        self.assertTrue(task.status == 124)
+        # The children of the program are killed too.
+        program = program_manager.Program('/bin/sh',
+                                          format = " -c 'sleep 7.25; true'")
+        program.SetTimeout(0.5, grace = 0.5)
+        task = scheduler.Scheduler(self.net).Run([program])[0]
+        self.assertTrue(task.status == 124)
+        time.sleep(0.2)
+        self.assertTrue(not find_process('sleep 7.25'))
+
+    def testAgentTime(self):
+        self.assertTrue(self.net.StartAgent(0.5) == [])
+        try:
+            program = program_manager.Program('/bin/sleep', format = ' 0.2')
+            task = scheduler.Scheduler(self.net).Run([program])[0]
+        finally:
+            self.net.StopAgent()
+        # The dates of the host are kept.
+        self.assertTrue(task.beg_time == task.process.beg_time)
+        self.assertTrue(task.end_time == task.process.end_time)
+        self.assertTrue(task.end_time - task.beg_time >= 0.2)
+
+    def testReaper(self):
+        import Queue, signal, subprocess, threading
+        def watch(reaper):
+            task = scheduler.Task(0, program_manager.Program('/bin/true'))
+            task.process = subprocess.Popen(['sleep', '0.2'])
+            start = time.time()
+            reaper.Add(task)
+            self.assertTrue(reaper.event.get(True, 5.) is task)
+            self.assertTrue(task.status == 0)
+            # The process was reaped: its process ID is not signaled.
+            self.assertTrue(len(reaper.process) == 0)
+            reaper.Kill(task)
+            return time.time() - start
+        # In the main thread, SIGCHLD wakes the thread up long before the
+        # next check.
+        handler = signal.getsignal(signal.SIGCHLD)
+        reaper = scheduler.Reaper(Queue.Queue(), interval = 60.)
+        self.assertTrue(reaper.CatchSignal())
+        reaper.start()
+        try:
+            self.assertTrue(watch(reaper) < 2.)
+        finally:
+            reaper.ReleaseSignal()
+            reaper.Stop()
+        self.assertTrue(signal.getsignal(signal.SIGCHLD) is handler)
+        # In another thread, the processes are checked periodically.
+        reaper = scheduler.Reaper(Queue.Queue(), interval = 0.1)
+        result = []
+        thread = threading.Thread(target = lambda:
+                                  result.append(reaper.CatchSignal()))
+        thread.start()
+        thread.join()
+        self.assertTrue(result == [False])
+        reaper.start()
+        try:
+            self.assertTrue(watch(reaper) < 2.)
+        finally:
+            reaper.Stop()
+        # The handling of SIGCHLD is restored after a run.
+        scheduler.Scheduler(self.net).Run([program_manager.Program(
+                    '/bin/true')])
+        self.assertTrue(signal.getsignal(signal.SIGCHLD) is handler)
+        wakeup_fd = signal.set_wakeup_fd(-1)
+        self.assertTrue(wakeup_fd == -1)
+
+    def testSpeculation(self):
+        import tempfile
+        # The plain processes cannot be killed on their hosts.
+        self.assertRaises(ValueError, scheduler.Scheduler, self.net,
+                          speculation = 0.5)
+        lock = tempfile.mkdtemp(prefix = 'puppet-test-')
+        os.rmdir(lock)
+        # Only the first copy of the slow program sleeps.
+        slow = program_manager.Program('/bin/sh', format = " -c 'if mkdir "
+                                       + lock + "; then sleep 30.5; fi'")
+        program_list = [program_manager.Program('/bin/true'), slow,
+                        program_manager.Program('/bin/true', group = 1)]
+        engine = scheduler.Scheduler(TwinNetwork(), batch = True,
+                                     speculation = 0.5)
+        start = time.time()
+        task_list = engine.Run(program_list)
+        os.rmdir(lock)
+        # The copy ended first, and the slow copy was killed on its host.
+        self.assertTrue(time.time() - start < 10.)
+        self.assertTrue([x.status for x in task_list] == [0, 0, 0])
+        self.assertTrue(task_list[1].speculated)
+        event_list = [x["event"] for x in engine.event_log.Read()]
+        self.assertTrue(event_list.count("speculate") == 1)
+        self.assertTrue(event_list.count("cancel") == 1)
+        time.sleep(0.2)
+        self.assertTrue(not find_process('sleep 30.5'))
+
+
+if __name__ == '__main__':
+    unittest.main()
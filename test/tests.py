@@ -2,7 +2,7 @@
 # Author: Damien Garaud
 #
 # This file is part of the PuppetMaster project. It checks the module
-# 'host', 'network' and 'program_manager'.
+# 'host', 'network', 'program_manager' and 'scheduler'.
 #
 # This script is free; you can redistribute it and/or modify it under the
 # terms of the GNU General Public License as published by the Free Software
@@ -24,7 +24,7 @@ import unittest
 ##################
 
 # The module names.
-__module_name__ = ['host', 'network', 'program_manager']
+__module_name__ = ['host', 'network', 'program_manager', 'scheduler']
 
 # Deletes all modules if they are already imported.
 # You don't have to reload 'ipython' if a module has changed.
@@ -32,13 +32,14 @@ for name in __module_name__:
     if sys.modules.has_key(name):
         del sys.modules[name]
 
-from puppetmaster import host, network, program_manager
+from puppetmaster import host, network, program_manager, scheduler
 
 # Same operation for test modules.
-for name in ['host_test', 'network_test', 'program_manager_test']:
+for name in ['host_test', 'network_test', 'program_manager_test',
+             'scheduler_test']:
     if sys.modules.has_key(name):
         del sys.modules[name]
-import host_test, network_test, program_manager_test
+import host_test, network_test, program_manager_test, scheduler_test
 
 
 ###################
@@ -50,7 +51,8 @@ usage = "%prog [options]"
 parser = optparse.OptionParser(usage = usage)
 parser.add_option("-m", "--module", dest="module_name", default='all',
                   help="The name of the tested module "\
-                      +"('all', 'host', 'network' or 'program_manager')."\
+                      +"('all', 'host', 'network', 'program_manager' or"\
+                      + " 'scheduler')."\
                       + " 'all' by default.")
 parser.add_option("-f", "--file",
                   help="The name of the file where there are the host names."\
@@ -127,6 +129,10 @@ if options.module_name == 'all':
                           ProgramManagerTestCase(method_name,
                                                  host_file,
                                                  options.forced_ssh))
+    # For the module 'scheduler'.
+    for method_name in scheduler_test.test_method_name:
+        suite.addTest(scheduler_test.SchedulerTestCase(method_name, host_file,
+                                                       options.forced_ssh))
     unittest.TextTestRunner(verbosity=2).run(suite)
 # 'host' module.
 elif options.module_name == 'host':
@@ -165,6 +171,13 @@ elif options.module_name == 'program_manager':
                                                  host_file,
                                                  options.forced_ssh))
     unittest.TextTestRunner(verbosity=2).run(suite)
+# 'scheduler' module.
+elif options.module_name == 'scheduler':
+    suite = unittest.TestSuite()
+    for method_name in scheduler_test.test_method_name:
+        suite.addTest(scheduler_test.SchedulerTestCase(method_name, host_file,
+                                                       options.forced_ssh))
+    unittest.TextTestRunner(verbosity=2).run(suite)
 else:
     parser.help_message()
     raise ValueError, "The option '-m %s' not found." % options.module_name